@@ -13,6 +13,9 @@ if config.config_file_name is not None:
 from app.models.base import BaseModel
 from app.models.user import AuthidModel, UserModel
 from app.models.revoked_token import RevokedTokenModel
+from app.models.signing_key import SigningKeyModel
+from app.models.rate_limit import RateLimitModel
+from app.models.refresh_session import RefreshSessionModel
 target_metadata = BaseModel.metadata
 
 def run_migrations_offline() -> None:
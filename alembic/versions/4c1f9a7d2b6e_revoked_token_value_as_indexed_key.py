@@ -0,0 +1,49 @@
+"""revoked token value as indexed key
+
+Revision ID: 4c1f9a7d2b6e
+Revises: e0d03de8858d
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1f9a7d2b6e'
+down_revision: Union[str, Sequence[str], None] = 'e0d03de8858d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows hold whole tokens issued before the jti claim existed
+    # convert them to the same digest JwtUtil.get_revocation_key falls back to
+    op.execute(
+        "UPDATE revoked_token_model "
+        "SET value = left(encode(sha256(convert_to(value, 'UTF8')), 'hex'), 32)"
+    )
+    # the old select-then-insert could revoke the same token twice
+    op.execute(
+        "DELETE FROM revoked_token_model a "
+        "USING revoked_token_model b "
+        "WHERE a.value = b.value AND a.id > b.id"
+    )
+    op.alter_column('revoked_token_model', 'value',
+               existing_type=sa.String(length=2048),
+               type_=sa.String(length=32),
+               existing_nullable=False)
+    op.create_unique_constraint('revoked_token_model_value_key', 'revoked_token_model', ['value'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # revoked tokens can not be restored from their keys, rows are kept as keys
+    op.drop_constraint('revoked_token_model_value_key', 'revoked_token_model', type_='unique')
+    op.alter_column('revoked_token_model', 'value',
+               existing_type=sa.String(length=32),
+               type_=sa.String(length=2048),
+               existing_nullable=False)
@@ -0,0 +1,122 @@
+"""partition revoked token model (optional)
+
+Opt-in, only runs with:
+    alembic -x partition_revoked_tokens=true upgrade head
+
+Turns revoked_token_model into a table range partitioned by day on datetime_ttl
+so the reaper can drop expired days as whole partitions instead of deleting rows.
+Without the flag this revision is a no-op. To switch later, downgrade to the
+previous revision and upgrade again with the flag.
+
+Partitioned tables need the partition key in every unique constraint, so the
+primary key becomes (id, datetime_ttl) and value is unique per datetime_ttl.
+Revocation ttls are derived from the token's exp, so a token always lands on the
+same datetime_ttl and stays unique.
+
+Revision ID: 9d8f2c4e6a13
+Revises: 7b3e5d1a9c20
+Create Date: 2026-10-18 11:20:45.602915
+
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d8f2c4e6a13'
+down_revision: Union[str, Sequence[str], None] = '7b3e5d1a9c20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# keep in sync with REAPER_PARTITION_PREMAKE_DAYS, the reaper creates the rest
+PREMAKE_DAYS = 10
+
+
+def _enabled() -> bool:
+    return context.get_x_argument(as_dictionary=True).get("partition_revoked_tokens", "").lower() in ("1", "true", "yes")
+
+
+def _is_partitioned() -> bool:
+    return bool(op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('revoked_token_model'))"
+    )).scalar())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _enabled() or _is_partitioned():
+        return
+
+    op.execute("ALTER TABLE revoked_token_model RENAME TO revoked_token_model_unpartitioned")
+    op.execute("ALTER SEQUENCE revoked_token_model_id_seq OWNED BY NONE")
+    op.execute("ALTER INDEX revoked_token_model_pkey RENAME TO revoked_token_model_unpartitioned_pkey")
+    op.execute("ALTER TABLE revoked_token_model_unpartitioned RENAME CONSTRAINT revoked_token_model_value_key TO revoked_token_model_unpartitioned_value_key")
+    op.execute("ALTER INDEX ix_revoked_token_model_datetime_ttl RENAME TO ix_revoked_token_model_unpartitioned_datetime_ttl")
+
+    op.execute("""
+        CREATE TABLE revoked_token_model (
+            value VARCHAR(32) NOT NULL,
+            datetime_ttl TIMESTAMP WITH TIME ZONE NOT NULL,
+            id BIGINT NOT NULL DEFAULT nextval('revoked_token_model_id_seq'),
+            datetime_created TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT revoked_token_model_pkey PRIMARY KEY (id, datetime_ttl),
+            CONSTRAINT revoked_token_model_value_key UNIQUE (value, datetime_ttl)
+        ) PARTITION BY RANGE (datetime_ttl)
+    """)
+    op.execute("ALTER SEQUENCE revoked_token_model_id_seq OWNED BY revoked_token_model.id")
+    op.create_index('ix_revoked_token_model_datetime_ttl', 'revoked_token_model', ['datetime_ttl'], unique=False)
+    # catches anything outside of the daily partitions, the reaper deletes from it in batches
+    op.execute("CREATE TABLE revoked_token_model_default PARTITION OF revoked_token_model DEFAULT")
+
+    today = datetime.now(timezone.utc).date()
+    for offset in range(PREMAKE_DAYS + 1):
+        day = today + timedelta(days=offset)
+        op.execute(
+            f"CREATE TABLE revoked_token_model_p{day:%Y%m%d} PARTITION OF revoked_token_model "
+            f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+        )
+
+    # expired rows are not worth copying
+    op.execute("""
+        INSERT INTO revoked_token_model (value, datetime_ttl, id, datetime_created)
+        SELECT value, datetime_ttl, id, datetime_created
+        FROM revoked_token_model_unpartitioned
+        WHERE datetime_ttl > now()
+    """)
+    op.execute("DROP TABLE revoked_token_model_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _is_partitioned():
+        return
+
+    op.execute("ALTER TABLE revoked_token_model RENAME TO revoked_token_model_partitioned")
+    op.execute("ALTER SEQUENCE revoked_token_model_id_seq OWNED BY NONE")
+    op.execute("ALTER INDEX revoked_token_model_pkey RENAME TO revoked_token_model_partitioned_pkey")
+    op.execute("ALTER TABLE revoked_token_model_partitioned RENAME CONSTRAINT revoked_token_model_value_key TO revoked_token_model_partitioned_value_key")
+    op.execute("ALTER INDEX ix_revoked_token_model_datetime_ttl RENAME TO ix_revoked_token_model_partitioned_datetime_ttl")
+
+    op.execute("""
+        CREATE TABLE revoked_token_model (
+            value VARCHAR(32) NOT NULL,
+            datetime_ttl TIMESTAMP WITH TIME ZONE NOT NULL,
+            id BIGINT NOT NULL DEFAULT nextval('revoked_token_model_id_seq'),
+            datetime_created TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT revoked_token_model_pkey PRIMARY KEY (id),
+            CONSTRAINT revoked_token_model_value_key UNIQUE (value)
+        )
+    """)
+    op.execute("ALTER SEQUENCE revoked_token_model_id_seq OWNED BY revoked_token_model.id")
+    op.create_index('ix_revoked_token_model_datetime_ttl', 'revoked_token_model', ['datetime_ttl'], unique=False)
+    op.execute("""
+        INSERT INTO revoked_token_model (value, datetime_ttl, id, datetime_created)
+        SELECT DISTINCT ON (value) value, datetime_ttl, id, datetime_created
+        FROM revoked_token_model_partitioned
+        WHERE datetime_ttl > now()
+        ORDER BY value, id
+    """)
+    op.execute("DROP TABLE revoked_token_model_partitioned")
@@ -1,6 +1,8 @@
+import logging
+from uuid import uuid4
 from typing import Annotated
 from datetime import datetime, timezone, timedelta
-from fastapi import APIRouter, status, Depends, HTTPException, Response, Form, Cookie
+from fastapi import APIRouter, status, HTTPException, Request, Form, Cookie, Depends, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.schemas.auth import (
@@ -8,87 +10,200 @@ from app.schemas.auth import (
     SignupRequestSchema, 
     LoginResponseSchema,
     SignupResponseSchema,
+    LogoutResponseSchema,
+    MessageSchema,
     AccessToken
 )
 
-from app.models.user import UserModel, AuthidModel
+from app.models.user import UserModel, AuthidModel, LoginCredentials
 from app.models.revoked_token import RevokedTokenModel
-from app.utils.db_util import get_transaction_session
-from app.utils.result_util import Error, Result
+from app.models.refresh_session import RefreshSessionModel
+from app.config import get_config
+from app.utils.db_util import TransactionSession, Reads, AsyncSessionLocal, get_replica_set
+from app.utils.result_util import Error, Ok, Result
 from app.utils.jwt_util import JwtUtil
-from app.utils.bcrypt_util import BcryptUtil
+from app.utils.refresh_token_util import RefreshTokenUtil
+from app.utils.bcrypt_util import BcryptUtil, PasswordHashPoolSaturatedError
+from app.utils.rate_limit_util import get_rate_limiter
+from app.utils.principal_cache_util import Principal
+from app.utils.security_util import auth_required
+from app.utils.response_util import SchemaJSONResponse
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# static bodies, built once
+LOGOUT_SUCCESSFUL = LogoutResponseSchema.model_construct(
+    payload=MessageSchema.model_construct(message="Logout successful"),
+    code=status.HTTP_200_OK
+)
+LOGOUT_ALL_SUCCESSFUL = LogoutResponseSchema.model_construct(
+    payload=MessageSchema.model_construct(message="Logged out of all sessions"),
+    code=status.HTTP_200_OK
+)
+
+
+def _client_ip(request: Request) -> str | None:
+    # behind a proxy run uvicorn with --proxy-headers so this is the real client
+    return request.client.host if request.client else None
+
+
+async def _throttle(scope: str, request: Request, email: str) -> None:
+    # before any db or bcrypt work
+    retry_after = await get_rate_limiter().check(scope=scope, ip=_client_ip(request), email=email)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts. Try again later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+async def _new_refresh_token(session: AsyncSession, user_id: int, authid_value: str) -> Result[str, Exception]:
+    # a jwt or, with REFRESH_TOKEN_MODE=opaque, the first token of a new refresh session family
+    if get_config().REFRESH_TOKEN_MODE == "jwt":
+        return JwtUtil().generate_refresh_token(authid_value=authid_value)
+
+    refresh_token_util = RefreshTokenUtil()
+    token_result = refresh_token_util.generate_opaque_token()
+    if isinstance(token_result, Error):
+        return token_result
+    
+    issue_result = await RefreshSessionModel.issue(
+        session=session,
+        token_hash=refresh_token_util.hash_opaque_token(token_result.data),
+        family_id=uuid4().hex,
+        user_id=user_id,
+        ttl=datetime.now(timezone.utc) + timedelta(days=get_config().REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    if isinstance(issue_result, Error):
+        return issue_result
+    return Ok(token_result.data)
+
+
+def _token_response(access_token: str, refresh_token: str, code: int) -> SchemaJSONResponse:
+    # login, signup and refresh, the cookie goes on the response that is returned
+    # (headers set on an injected Response are dropped when a Response is returned)
+    response = SchemaJSONResponse(
+        LoginResponseSchema.model_construct(payload=AccessToken.model_construct(access=access_token), code=code)
+    )
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,           # JS cannot read it
+        secure=False,             # HTTPS only (True in prod)
+        samesite="lax",          # or "strict"
+        max_age=60 * 60 * 24 * 7,  # 7 days in seconds
+        path="/api/auth/"
+    )
+    return response
+
+
+async def _rehash_password(user_id: int, plain: str, old_hash: str) -> None:
+    # background task, runs after the login response went out
+    # if anything fails the hash stays as it is and the next login tries again
+    try:
+        new_hash = await BcryptUtil().hash_password_async(plain)
+    except PasswordHashPoolSaturatedError:
+        return
+    
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            update_result = await UserModel.update_password_hash(session, user_id, old_hash, new_hash)
+    if isinstance(update_result, Error):
+        logger.warning("Unable to rehash password of user %s: %s", user_id, update_result.error)
+
+
 @router.post("/login", response_model=LoginResponseSchema)
 async def login(
-        response: Response, 
+        request: Request,
         login_data: Annotated[LoginRequestSchema, Form()], 
-        session: AsyncSession = Depends(get_transaction_session)
+        session: TransactionSession,
+        reads: Reads,
+        background_tasks: BackgroundTasks
     ):
 
-    # check user exist
-    email_check_result = await UserModel.get_by_email(session, login_data.email.lower())
-    if isinstance(email_check_result, Error):
+    await _throttle("login", request, login_data.email)
+    rate_limiter = get_rate_limiter()
+    client_ip = _client_ip(request)
+
+    # check user exist, only the columns login needs (a replica when there is one, see ReadRouter)
+    # a miss is only asked again on the primary for an email this worker signed up a moment ago
+    email = login_data.email.lower()
+    credentials_result = await reads.read(
+        lambda s: UserModel.get_login_credentials(s, email),
+        retry_missing=get_replica_set().recently_written(email)
+    )
+    if isinstance(credentials_result, Error):
         raise HTTPException(status_code=500)
     
-    if email_check_result.data is None:
+    if credentials_result.data is None:
+        await rate_limiter.record_failure("login", client_ip, login_data.email)
         raise HTTPException(status_code=401, detail="email and/or password is invalid")
     
-    user_model: UserModel = email_check_result.data
-    if not BcryptUtil().verify_password(login_data.password, user_model.password):
+    credentials: LoginCredentials = credentials_result.data
+    bcrypt_util = BcryptUtil()
+    try:
+        password_ok = await bcrypt_util.verify_password_async(login_data.password, credentials.password)
+    except PasswordHashPoolSaturatedError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy. Try again later",
+            headers={"Retry-After": "1"}
+        )
+
+    if not password_ok:
+        await rate_limiter.record_failure("login", client_ip, login_data.email)
         raise HTTPException(status_code=401, detail="email and/or password is invalid")
     
+    await rate_limiter.record_success("login", login_data.email)
+
+    # hashed with another scheme or other costs than configured now, upgrade it without making this login wait
+    if get_config().PASSWORD_REHASH_ON_LOGIN and bcrypt_util.needs_update(credentials.password):
+        background_tasks.add_task(_rehash_password, credentials.user_id, login_data.password, credentials.password)
+
     # TODO: check if user has been deleted - Stop login
     # TODO: check if user was deactivated - Reactivate user
     
     jwt_util = JwtUtil()
-    access_token_result = jwt_util.generate_access_token(authid_value=user_model.authid.value)
+    access_token_result = jwt_util.generate_access_token(authid_value=credentials.authid_value)
     if isinstance(access_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create access token.")
     
-    refresh_token_result = jwt_util.generate_refresh_token(authid_value=user_model.authid.value)
+    refresh_token_result = await _new_refresh_token(session, credentials.user_id, credentials.authid_value)
     if isinstance(refresh_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create refresh token.")
-    
-    AccessToken(
-        access=access_token_result.data
-    )
-
-    
-
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token_result.data,
-        httponly=True,           # JS cannot read it
-        secure=False,             # HTTPS only (True in prod)
-        samesite="lax",          # or "strict"
-        max_age=60 * 60 * 24 * 7,  # 7 days in seconds
-        path="/api/auth/"
-    )
 
-    return LoginResponseSchema(
-        payload=AccessToken(
-            access=access_token_result.data
-        ),
-        code=status.HTTP_200_OK
-    )
+    return _token_response(access_token_result.data, refresh_token_result.data, status.HTTP_200_OK)
 
 
 @router.post("/signup", response_model=SignupResponseSchema)
-async def signup(response: Response, signup_data: SignupRequestSchema, session: AsyncSession = Depends(get_transaction_session)):
+async def signup(request: Request, signup_data: SignupRequestSchema, session: TransactionSession, reads: Reads):
 
-    email_check_result = await UserModel.get_by_email(session, signup_data.email.lower())
-    if isinstance(email_check_result, Error):
+    await _throttle("signup", request, signup_data.email)
+
+    # cheap check before the password is hashed, a replica missing a brand new user only means
+    # the insert below finds the conflict instead
+    exists_result = await reads.read(lambda s: UserModel.email_exists(s, signup_data.email))
+    if isinstance(exists_result, Error):
         raise HTTPException(status_code=500)
-    
-    if email_check_result.data is not None:
+    if exists_result.data:
         raise HTTPException(status_code=409, detail="Email address already in use")
 
     new_user_result = await UserModel.create(session, signup_data)
     if isinstance(new_user_result, Error):
+        if isinstance(new_user_result.error, PasswordHashPoolSaturatedError):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy. Try again later",
+                headers={"Retry-After": "1"}
+            )
         raise HTTPException(status_code=500)
     
+    # insert hit the unique email constraint, also covers two signups racing for the same email
+    if new_user_result.data is None:
+        raise HTTPException(status_code=409, detail="Email address already in use")
     
     user_model: UserModel = new_user_result.data
 
@@ -98,106 +213,102 @@ async def signup(response: Response, signup_data: SignupRequestSchema, session:
     if isinstance(access_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create access token. Please try to login.")
     
-    refresh_token_result = jwt_util.generate_refresh_token(authid_value=user_model.authid.value)
+    refresh_token_result = await _new_refresh_token(session, user_model.id, user_model.authid.value)
     if isinstance(refresh_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create refresh token. Please try to login.")
 
+    return _token_response(access_token_result.data, refresh_token_result.data, status.HTTP_201_CREATED)
 
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token_result.data,
-        httponly=True,           # JS cannot read it
-        secure=False,             # HTTPS only (in prod)
-        samesite="lax",          # or "strict"
-        max_age=60 * 60 * 24 * 7,  # 7 days in seconds
-        path="/api/auth/"
-    )
 
-    return SignupResponseSchema(
-        payload=AccessToken(
-            access=access_token_result.data
-        ),
-        code=status.HTTP_201_CREATED
-    )
-
-
-@router.post("/logout")
+@router.post("/logout", response_model=LogoutResponseSchema)
 async def logout(
-        refresh_token: str | None = Cookie(None),
-        session: AsyncSession = Depends(get_transaction_session)
+        session: TransactionSession,
+        refresh_token: str | None = Cookie(None)
     ):
 
     # this helps with user experience.
     # no cookie, nothing to revoke, logout successful
     if refresh_token is None:
-        return {
-            "payload": {
-                "message": "Logout successful"
-            },
-            "code": status.HTTP_200_OK
-        }
+        return SchemaJSONResponse(LOGOUT_SUCCESSFUL)
     
+    # opaque token, ends its whole refresh session family
+    refresh_token_util = RefreshTokenUtil()
+    if refresh_token_util.is_opaque(refresh_token):
+        revoke_family_result = await RefreshSessionModel.revoke_family(
+            session=session,
+            token_hash=refresh_token_util.hash_opaque_token(refresh_token)
+        )
+        if isinstance(revoke_family_result, Error):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Server error. Try again later"
+            )
+        
+        return SchemaJSONResponse(LOGOUT_SUCCESSFUL)
 
-    decode_result = JwtUtil().decode_refresh_token(token=refresh_token)
+    jwt_util = JwtUtil()
+    decode_result = jwt_util.decode_refresh_token(token=refresh_token)
     if isinstance(decode_result, Error): # expired token will also hit this
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"{decode_result.error}"
         )
     
-    revoked_token_result = await RevokedTokenModel.get_by_value(
+    # ttl is a day past the refresh token's own exp
+    # this ensures that refresh token had already expired before it gets cleanup from the database
+    # derived from the token (not from now) so the same token always gets the same ttl
+    ttl = datetime.fromtimestamp(decode_result.data["exp"], timezone.utc) + timedelta(days=1)
+
+    # insert-or-ignore, revoking an already revoked token is still a successful logout
+    revoke_result = await RevokedTokenModel.revoke(
         session=session,
-        value=refresh_token
+        value=jwt_util.get_revocation_key(refresh_token, decode_result.data),
+        ttl=ttl
     )
 
-    if isinstance(revoked_token_result, Error):
+    if isinstance(revoke_result, Error):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error. Try again later"
         )
     
-    if revoked_token_result.data is not None: # already in db, nothing more to revoke.
-
-        return {
-            "payload": {
-                "message": "Logout successful"
-            },
-            "code": status.HTTP_200_OK
-        }
-    
-    # Everything checks out, revoke token
     
-    # since refresh token's life is 7 days from creation
-    # ttl is 8 days whether refresh token's life is still 7 days or 7 seconds left
-    # this ensures that refresh token had already expired before it gets cleanup from the database
-    ttl = datetime.now(timezone.utc) + timedelta(days=8)
+    return SchemaJSONResponse(LOGOUT_SUCCESSFUL)
 
-    new_revoked_token_result = await RevokedTokenModel.create(
-        session=session,
-        value=refresh_token,
-        ttl=ttl
-    )
 
-    if isinstance(new_revoked_token_result, Error):
+@router.post("/logout-all", response_model=LogoutResponseSchema)
+async def logout_all(
+        session: TransactionSession,
+        current_user: Principal = Depends(auth_required)
+    ):
+
+    # one update, every access and refresh token of this user (this one included) stops working
+    rotate_result = await AuthidModel.rotate(session=session, authid_value=current_user.authid_value)
+    if isinstance(rotate_result, Error):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error. Try again later"
         )
     
-    
-    return {
-        "payload": {
-            "message": "Logout successful"
-        },
-        "code": status.HTTP_200_OK
-    }
+    # Ok(None) means a concurrent logout-all rotated it first, same outcome
+
+    # opaque refresh sessions point at the user, not the authid
+    revoke_all_result = await RefreshSessionModel.revoke_all(session=session, user_id=current_user.id)
+    if isinstance(revoke_all_result, Error):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Server error. Try again later"
+        )
+
+    response = SchemaJSONResponse(LOGOUT_ALL_SUCCESSFUL)
+    response.delete_cookie(key="refresh_token", path="/api/auth/")
+    return response
 
 
-@router.post("/refresh")
+@router.post("/refresh", response_model=LoginResponseSchema)
 async def refresh(
-        response: Response,
-        refresh_token: str | None = Cookie(None),
-        session: AsyncSession = Depends(get_transaction_session)
+        session: TransactionSession,
+        refresh_token: str | None = Cookie(None)
     ):
     if refresh_token is None:
         raise HTTPException(
@@ -205,16 +316,21 @@ async def refresh(
             detail="Missing/invalid refresh token"
         )
     
-    decode_result = JwtUtil().decode_refresh_token(token=refresh_token)
+    if RefreshTokenUtil().is_opaque(refresh_token):
+        return await _refresh_opaque(session, refresh_token)
+    
+    jwt_util = JwtUtil()
+    decode_result = jwt_util.decode_refresh_token(token=refresh_token)
     if isinstance(decode_result, Error): # expired token will also hit this
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"{decode_result.error}"
         )
     
-    revoked_token_result = await RevokedTokenModel.get_by_value(
+    revocation_key = jwt_util.get_revocation_key(refresh_token, decode_result.data)
+    revoked_token_result = await RevokedTokenModel.is_revoked(
         session=session,
-        value=refresh_token
+        value=revocation_key
     )
 
     if isinstance(revoked_token_result, Error):
@@ -223,8 +339,8 @@ async def refresh(
             detail="Server error. Try again later"
         )
     
-    # if it is already in db
-    if revoked_token_result.data is not None:
+    # if it is already revoked
+    if revoked_token_result.data:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing/invalid refresh token"
@@ -239,71 +355,112 @@ async def refresh(
             detail="Missing/invalid refresh token"
         )
     
-    authid_result = await AuthidModel.get_by_value(
+    principal_result = await UserModel.get_principal_by_authid(
         session=session,
-        value=sub
+        authid_value=sub
     )
-    if isinstance(authid_result, Error):
+    if isinstance(principal_result, Error):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error. Try again later"
         )
     
-    if authid_result.data is None:
+    if principal_result.data is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing/invalid refresh token"
         )
     
-    user_model: UserModel = authid_result.data.user
-    if user_model.datetime_deactivated or user_model.datetime_deleted:
+    principal: Principal = principal_result.data
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing/invalid refresh token"
         )
     
     # create new access and refresh token
-    jwt_util = JwtUtil()
-    access_token_result = jwt_util.generate_access_token(authid_value=user_model.authid.value)
+    access_token_result = jwt_util.generate_access_token(authid_value=principal.authid_value)
     if isinstance(access_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create access token.")
     
-    refresh_token_result = jwt_util.generate_refresh_token(authid_value=user_model.authid.value)
+    # with REFRESH_TOKEN_MODE=opaque this is where a jwt session switches over
+    refresh_token_result = await _new_refresh_token(session, principal.id, principal.authid_value)
     if isinstance(refresh_token_result, Error):
         raise HTTPException(status_code=500, detail="Unable to create refresh token.")
     
     # revoke old refresh token
-    ttl = datetime.now(timezone.utc) + timedelta(days=8)
+    ttl = datetime.fromtimestamp(payload["exp"], timezone.utc) + timedelta(days=1)
 
-    new_revoked_token_result = await RevokedTokenModel.create(
+    revoke_result = await RevokedTokenModel.revoke(
         session=session,
-        value=refresh_token,
+        value=revocation_key,
         ttl=ttl
     )
 
-    if isinstance(new_revoked_token_result, Error):
+    if isinstance(revoke_result, Error):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Server error. Try again later"
         )
     
-    AccessToken(
-        access=access_token_result.data
-    )
+    # a concurrent refresh with the same token got there first
+    if not revoke_result.data:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing/invalid refresh token"
+        )
 
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token_result.data,
-        httponly=True,           # JS cannot read it
-        secure=False,             # HTTPS only (True in prod)
-        samesite="lax",          # or "strict"
-        max_age=60 * 60 * 24 * 7,  # 7 days in seconds
-        path="/api/auth/"
+    return _token_response(access_token_result.data, refresh_token_result.data, status.HTTP_200_OK)
+
+
+async def _refresh_opaque(session: AsyncSession, refresh_token: str) -> SchemaJSONResponse:
+    # one statement: the presented token is used up, the next one in its family is issued
+    # and the principal is loaded, there is no signature to check and no revocation lookup
+    refresh_token_util = RefreshTokenUtil()
+    new_refresh_token_result = refresh_token_util.generate_opaque_token()
+    if isinstance(new_refresh_token_result, Error):
+        raise HTTPException(status_code=500, detail="Unable to create refresh token.")
+    
+    token_hash = refresh_token_util.hash_opaque_token(refresh_token)
+    rotate_result = await RefreshSessionModel.rotate(
+        session=session,
+        token_hash=token_hash,
+        new_token_hash=refresh_token_util.hash_opaque_token(new_refresh_token_result.data),
+        ttl=datetime.now(timezone.utc) + timedelta(days=get_config().REFRESH_TOKEN_EXPIRE_DAYS)
     )
+    if isinstance(rotate_result, Error):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Server error. Try again later"
+        )
+    
+    if rotate_result.data is None:
+        # unknown, expired or revoked, or already used: then it was replayed and the family is revoked
+        reuse_result = await RefreshSessionModel.revoke_family_if_reused(session=session, token_hash=token_hash)
+        if isinstance(reuse_result, Error):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Server error. Try again later"
+            )
+        
+        # the 401 below rolls the request's transaction back, the revocation has to stick
+        if reuse_result.data:
+            await session.commit()
+        
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing/invalid refresh token"
+        )
+    
+    principal: Principal = rotate_result.data
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing/invalid refresh token"
+        )
+    
+    access_token_result = JwtUtil().generate_access_token(authid_value=principal.authid_value)
+    if isinstance(access_token_result, Error):
+        raise HTTPException(status_code=500, detail="Unable to create access token.")
 
-    return LoginResponseSchema(
-        payload=AccessToken(
-            access=access_token_result.data
-        ),
-        code=status.HTTP_200_OK
-    )
\ No newline at end of file
+    return _token_response(access_token_result.data, new_refresh_token_result.data, status.HTTP_200_OK)
\ No newline at end of file
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from app.utils.db_util import get_engine, get_pool_stats, get_replica_set
+from app.utils.bcrypt_util import get_password_hash_pool
+from app.utils.revocation_cache_util import get_revocation_cache
+from app.utils.principal_cache_util import get_principal_cache
+from app.utils.invalidation_util import get_invalidation_bus
+from app.utils.reaper_util import get_reaper
+from app.utils.token_cache_util import get_verified_token_cache
+from app.utils.rate_limit_util import get_rate_limiter
+from app.utils.metrics_util import render_latest
+
+# operational endpoints, numbers are per worker process
+router = APIRouter()
+
+@router.get("/stats")
+async def stats():
+    return {
+        "db_pool": get_pool_stats(get_engine()),
+        "db_replicas": get_replica_set().stats(),
+        "password_hash_pool": get_password_hash_pool().stats(),
+        "revocation_cache": get_revocation_cache().stats(),
+        "principal_cache": get_principal_cache().stats(),
+        "invalidation_bus": get_invalidation_bus().stats(),
+        "verified_token_cache": get_verified_token_cache().stats(),
+        "rate_limiter": get_rate_limiter().stats(),
+        "reaper": get_reaper().stats(),
+    }
+
+
+# prometheus text format, summed over every worker when PROMETHEUS_MULTIPROC_DIR is set
+@router.get("/metrics")
+async def metrics():
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
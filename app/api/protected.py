@@ -1,25 +1,23 @@
-from typing import Annotated
 from fastapi import APIRouter, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from app.schemas.user import MeSchema, MeResponseSchema
 from app.utils.security_util import auth_required
-from app.utils.db_util import get_transaction_session
-from app.models.user import UserModel
+from app.utils.principal_cache_util import Principal
+from app.utils.response_util import SchemaJSONResponse
 
 router = APIRouter()
 
-@router.get("/me")
+@router.get("/me", response_model=MeResponseSchema)
 async def protected(
-        current_user: UserModel = Depends(auth_required), 
-        session = Annotated[AsyncSession, Depends(get_transaction_session)]
+        current_user: Principal = Depends(auth_required)
     ):
 
-    return {
-        "message": "This is a protected route. Bearer access token is required",
-        "payload": {
-            "id": current_user.id,
-            "firstname": current_user.firstname,
-            "lastname": current_user.lastname,
-            "pid": current_user.pid,
-            "email": current_user.email
-        }
-    }
\ No newline at end of file
+    return SchemaJSONResponse(MeResponseSchema.model_construct(
+        message="This is a protected route. Bearer access token is required",
+        payload=MeSchema.model_construct(
+            id=current_user.id,
+            firstname=current_user.firstname,
+            lastname=current_user.lastname,
+            pid=current_user.pid,
+            email=current_user.email
+        )
+    ))
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from app.config import get_config
+from app.utils.jwk_util import get_keyring
+
+router = APIRouter()
+
+# public keys for access tokens, other services verify tokens locally with these
+@router.get("/jwks.json")
+async def jwks(response: Response):
+    response.headers["Cache-Control"] = f"public, max-age={get_config().JWKS_MAX_AGE_SECONDS}"
+    return get_keyring().jwks()
@@ -0,0 +1,95 @@
+"""
+Pick the password hashing cost for this machine, the highest one whose verify stays under a target time.
+
+    python -m app.cli.calibrate_hash                        # bcrypt, 250ms per verify
+    python -m app.cli.calibrate_hash --scheme argon2 --target-ms 100 --memory-kib 19456
+
+Run it on the hardware the app runs on. It prints the settings to put in the environment (or .env),
+stored hashes with other costs are rehashed on the next login of each user (PASSWORD_REHASH_ON_LOGIN).
+Verify time is what login waits on, and a worker is busy for that long per login
+(PASSWORD_HASH_WORKERS of them per process).
+"""
+import time
+import argparse
+import statistics
+from app.config import Config
+from app.utils.bcrypt_util import build_pwd_context
+
+PASSWORD = "calibration-password"
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+ARGON2_MAX_TIME_COST = 50
+
+
+def _default(field: str):
+    # Config defaults without building a Config (no DATABASE_URL etc. needed here)
+    return Config.model_fields[field].default
+
+
+def measure_verify(scheme: str, cost: int, memory_kib: int, parallelism: int, samples: int) -> float:
+    # median verify time in ms, one warm-up verify first
+    context = build_pwd_context(
+        scheme=scheme,
+        bcrypt_rounds=cost if scheme == "bcrypt" else _default("PASSWORD_HASH_BCRYPT_ROUNDS"),
+        argon2_time_cost=cost if scheme == "argon2" else _default("PASSWORD_HASH_ARGON2_TIME_COST"),
+        argon2_memory_kib=memory_kib,
+        argon2_parallelism=parallelism
+    )
+    hashed = context.hash(PASSWORD)
+    context.verify(PASSWORD, hashed)
+
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify(PASSWORD, hashed)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(args: argparse.Namespace) -> tuple[int, list[tuple[int, float]]]:
+    # costs only go up, stop at the first one over the target
+    if args.scheme == "bcrypt":
+        costs = range(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS + 1)
+    else:
+        costs = range(1, ARGON2_MAX_TIME_COST + 1)
+
+    measured = []
+    chosen = costs[0] # even if that is over the target, it is the cheapest there is
+    for cost in costs:
+        median_ms = measure_verify(args.scheme, cost, args.memory_kib, args.parallelism, args.samples)
+        measured.append((cost, median_ms))
+        print(f"  {'rounds' if args.scheme == 'bcrypt' else 'time cost'} {cost:>3}: {median_ms:9.1f} ms")
+        if median_ms > args.target_ms:
+            break
+        chosen = cost
+    return chosen, measured
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{args.scheme}, median of {args.samples} verifies, target {args.target_ms:g} ms")
+    chosen, measured = calibrate(args)
+    chosen_ms = dict(measured)[chosen]
+
+    if chosen_ms > args.target_ms:
+        print(f"\neven the cheapest cost takes {chosen_ms:.1f} ms, the target can not be met on this machine")
+    if args.scheme == "bcrypt" and chosen < 10:
+        print(f"\nwarning: {chosen} rounds is weak, consider a higher target or a faster machine")
+
+    print(f"\n# {chosen_ms:.1f} ms per verify on this machine")
+    print(f"PASSWORD_HASH_SCHEME={args.scheme}")
+    if args.scheme == "bcrypt":
+        print(f"PASSWORD_HASH_BCRYPT_ROUNDS={chosen}")
+    else:
+        print(f"PASSWORD_HASH_ARGON2_TIME_COST={chosen}")
+        print(f"PASSWORD_HASH_ARGON2_MEMORY_KIB={args.memory_kib}")
+        print(f"PASSWORD_HASH_ARGON2_PARALLELISM={args.parallelism}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the password hashing cost for a target verify time")
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt")
+    parser.add_argument("--target-ms", type=float, default=250, help="upper bound for one verify (default 250)")
+    parser.add_argument("--samples", type=int, default=5, help="verifies timed per cost (default 5)")
+    parser.add_argument("--memory-kib", type=int, default=_default("PASSWORD_HASH_ARGON2_MEMORY_KIB"), help="argon2 only, fixed while the time cost is searched")
+    parser.add_argument("--parallelism", type=int, default=_default("PASSWORD_HASH_ARGON2_PARALLELISM"), help="argon2 only")
+    main(parser.parse_args())
@@ -0,0 +1,207 @@
+"""
+Bulk import users from a csv or jsonl file, i.e. when migrating accounts from another system.
+
+    python -m app.cli.import_users users.csv
+    python -m app.cli.import_users users.jsonl --chunk-size 5000 --workers 8
+
+Every row needs firstname, lastname, email and either password (plaintext, hashed here in a
+process pool) or password_hash (an existing bcrypt hash, stored as is). Same validation as signup.
+
+The file is streamed in chunks, each chunk is one transaction (COPY into a temp table, then one
+insert for authids and users), so memory stays flat whatever the file size. While a chunk is
+written the next one is already being hashed.
+
+Progress is checkpointed after every committed chunk (<input>.checkpoint.json), running the same
+command again resumes after the last committed row. Rejected rows are appended to
+<input>.errors.jsonl with their row number and reason. If the import dies between a commit and
+its checkpoint, the rerun reports that chunk's rows as "email already in use".
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+import logging
+from itertools import islice
+from typing import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pydantic import ValidationError
+from app.constants import PID_MIN_LENGTH, PID_MAX_LENGTH, AUTHID_MIN_LENGTH, AUTHID_MAX_LENGTH
+from app.schemas.auth import ImportUserSchema
+from app.models.user import UserModel
+from app.utils.string_util import StringUtil
+from app.utils.bcrypt_util import BcryptUtil
+from app.utils.db_util import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# row number, parsed row (None if it could not be parsed), parse error
+RawRow = tuple[int, dict | None, str | None]
+
+
+def read_rows(path: str, file_format: str) -> Iterator[RawRow]:
+    # row numbers count data rows from 1, blank jsonl lines are skipped but still counted
+    with open(path, newline="", encoding="utf-8") as f:
+        if file_format == "csv":
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                # an empty cell is a missing value (i.e. password_hash when password is set)
+                yield row_number, {key: value or None for key, value in row.items()}, None
+            return
+
+        for row_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, None, f"invalid json: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, "invalid json: expected an object"
+                continue
+            yield row_number, row, None
+
+
+def chunked(rows: Iterator[RawRow], size: int) -> Iterator[list[RawRow]]:
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def validate(chunk: list[RawRow]) -> tuple[list[tuple[int, ImportUserSchema]], list[dict]]:
+    valid, errors = [], []
+    for row_number, row, parse_error in chunk:
+        if parse_error is not None:
+            errors.append({"row": row_number, "error": parse_error})
+            continue
+        try:
+            valid.append((row_number, ImportUserSchema.model_validate(row)))
+        except ValidationError as e:
+            reasons = "; ".join(f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}" for error in e.errors())
+            errors.append({"row": row_number, "email": row.get("email"), "error": reasons})
+    return valid, errors
+
+
+async def prepare(chunk: list[RawRow], pool: ProcessPoolExecutor, workers: int) -> tuple[list[tuple], list[dict], int]:
+    # returns (records for UserModel.bulk_create, errors, last row number of the chunk)
+    valid, errors = validate(chunk)
+
+    plaintext = [user.password for _, user in valid if user.password_hash is None]
+    loop = asyncio.get_running_loop()
+    hashes = await loop.run_in_executor(
+        None, lambda: list(pool.map(BcryptUtil().hash_password, plaintext, chunksize=max(1, len(plaintext) // (workers * 4))))
+    )
+    hashes = iter(hashes)
+
+    string_util = StringUtil()
+    records = []
+    for row_number, user in valid:
+        # same normalization as UserModel.create
+        records.append((
+            row_number,
+            user.firstname.title(),
+            user.lastname.title(),
+            user.email.lower(),
+            user.password_hash if user.password_hash is not None else next(hashes),
+            string_util.generate_random(min_length=PID_MIN_LENGTH, max_length=PID_MAX_LENGTH).unwrap_or_raise(),
+            string_util.generate_random(min_length=AUTHID_MIN_LENGTH, max_length=AUTHID_MAX_LENGTH).unwrap_or_raise(),
+        ))
+    return records, errors, chunk[-1][0]
+
+
+async def write(records: list[tuple]) -> set[int]:
+    if not records:
+        return set()
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            return set((await UserModel.bulk_create(session, records)).unwrap_or_raise())
+
+
+def load_checkpoint(path: str, input_path: str) -> dict:
+    if not os.path.exists(path):
+        return {"input": input_path, "rows_done": 0, "inserted": 0, "failed": 0}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != input_path:
+        raise SystemExit(f"{path} belongs to {checkpoint.get('input')}, use --restart to start over")
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    # write then rename, a crash never leaves a half written checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+async def main(args: argparse.Namespace) -> None:
+    input_path = os.path.abspath(args.input)
+    file_format = args.format or ("jsonl" if input_path.endswith((".jsonl", ".ndjson")) else "csv")
+    checkpoint_path = args.checkpoint or f"{input_path}.checkpoint.json"
+    errors_path = args.errors or f"{input_path}.errors.jsonl"
+
+    if args.restart:
+        for path in (checkpoint_path, errors_path):
+            if os.path.exists(path):
+                os.remove(path)
+    checkpoint = load_checkpoint(checkpoint_path, input_path)
+    if checkpoint["rows_done"]:
+        logger.info("Resuming after row %s", checkpoint["rows_done"])
+
+    rows = (row for row in read_rows(input_path, file_format) if row[0] > checkpoint["rows_done"])
+    started = time.perf_counter()
+    imported_this_run = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, open(errors_path, "a", encoding="utf-8") as errors_file:
+
+        async def commit(prepared: tuple[list[tuple], list[dict], int]) -> None:
+            nonlocal imported_this_run
+            records, errors, last_row_number = prepared
+            inserted = await write(records)
+            errors.extend(
+                {"row": record[0], "email": record[3], "error": "email already in use"}
+                for record in records if record[0] not in inserted
+            )
+            for error in sorted(errors, key=lambda error: error["row"]):
+                errors_file.write(json.dumps(error) + "\n")
+            errors_file.flush()
+
+            checkpoint["rows_done"] = last_row_number
+            checkpoint["inserted"] += len(inserted)
+            checkpoint["failed"] += len(errors)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            imported_this_run += len(inserted)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Row %s: %s inserted, %s failed in total (%.0f users/s)",
+                last_row_number, checkpoint["inserted"], checkpoint["failed"], imported_this_run / elapsed if elapsed else 0
+            )
+
+        # at most two chunks in memory: the one being written and the next one being hashed
+        pending: asyncio.Task | None = None
+        for chunk in chunked(rows, args.chunk_size):
+            next_chunk = asyncio.create_task(prepare(chunk, pool, args.workers))
+            if pending is not None:
+                await commit(await pending)
+            pending = next_chunk
+        if pending is not None:
+            await commit(await pending)
+
+    print(json.dumps({**checkpoint, "errors_file": errors_path, "seconds": round(time.perf_counter() - started, 2)}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import users from csv or jsonl")
+    parser.add_argument("input", help="csv with a header row, or jsonl with one object per line")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="default from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per transaction (default 1000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes hashing plaintext passwords (default cpu count)")
+    parser.add_argument("--checkpoint", default=None, help="default <input>.checkpoint.json")
+    parser.add_argument("--errors", default=None, help="default <input>.errors.jsonl")
+    parser.add_argument("--restart", action="store_true", help="ignore and remove an existing checkpoint and error report")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
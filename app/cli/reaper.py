@@ -0,0 +1,37 @@
+"""
+Purge expired revoked tokens outside of the app, i.e. from cron or a sidecar container.
+
+    python -m app.cli.reaper            # one run, prints the report as json
+    python -m app.cli.reaper --forever  # keeps running every REAPER_INTERVAL_SECONDS
+"""
+import json
+import asyncio
+import argparse
+import logging
+from app.config import get_config
+from app.utils.reaper_util import RevokedTokenReaper
+
+
+async def main(args: argparse.Namespace) -> None:
+    config = get_config()
+    reaper = RevokedTokenReaper(
+        batch_size=args.batch_size or config.REAPER_BATCH_SIZE,
+        max_batches=args.max_batches or config.REAPER_MAX_BATCHES,
+        batch_pause_seconds=config.REAPER_BATCH_PAUSE_SECONDS,
+        partition_premake_days=config.REAPER_PARTITION_PREMAKE_DAYS
+    )
+
+    if args.forever:
+        await reaper.run_forever(config.REAPER_INTERVAL_SECONDS)
+    else:
+        report = await reaper.run_once()
+        print(json.dumps(report.to_dict()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge expired revoked tokens")
+    parser.add_argument("--forever", action="store_true", help="keep running every REAPER_INTERVAL_SECONDS")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--max-batches", type=int, default=None)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
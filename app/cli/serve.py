@@ -0,0 +1,142 @@
+"""
+Serve the app with preforked workers: the app and everything it imports is loaded once in this
+process, then the workers are forked from it and share those pages copy-on-write
+(uvicorn --workers starts fresh interpreters that each import everything again).
+
+    python -m app.cli.serve --host 0.0.0.0 --port 5000 --workers 4
+
+Nothing connects to the database before the fork, every worker creates its own engine and runs
+the lifespan (pool warmup, background tasks) itself. A worker that dies is replaced, SIGTERM or
+SIGINT stops them all gracefully (in flight requests finish, pools are disposed).
+"""
+import os
+import gc
+import sys
+import signal
+import socket
+import logging
+import argparse
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# exit code of a worker that never finished starting (i.e. the lifespan startup failed),
+# replacing it would fail the same way so everything shuts down instead
+WORKER_BOOT_ERROR = 3
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, args: argparse.Namespace) -> int:
+    # in the forked child, the frozen objects stay out of gc but new ones are collected as usual
+    gc.enable()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        proxy_headers=args.proxy_headers,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else WORKER_BOOT_ERROR
+
+
+def spawn(app, sock: socket.socket, args: argparse.Namespace) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = WORKER_BOOT_ERROR
+        try:
+            code = run_worker(app, sock, args)
+        except BaseException:
+            logger.exception("Worker %s crashed", os.getpid())
+        finally:
+            # never return into the supervisor loop of the parent's copy
+            os._exit(code)
+    return pid
+
+
+def main(args: argparse.Namespace) -> int:
+    # no collections while importing, so the freeze below catches everything that was loaded
+    gc.disable()
+    from app.main import create_app # preload, the engine is not created by this
+    app = create_app()
+    sock = bind_socket(args.host, args.port, args.backlog)
+
+    # moves every object that exists now into a permanent generation gc never scans or touches,
+    # otherwise the first collection in each worker writes to (and so copies) all of those pages
+    gc.collect()
+    gc.freeze()
+
+    workers: set[int] = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        workers.add(spawn(app, sock, args))
+    logger.info("Serving on %s:%s with %s preforked workers", args.host, args.port, args.workers)
+
+    exit_code = 0
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        if pid not in workers:
+            continue
+        workers.discard(pid)
+        if stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        if code == WORKER_BOOT_ERROR:
+            logger.error("Worker %s failed to start, shutting down", pid)
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+
+        logger.warning("Worker %s exited with %s, starting a new one", pid, code)
+        workers.add(spawn(app, sock, args))
+
+    sock.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with workers forked from one preloaded process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="seconds in flight requests get on shutdown (default 30)")
+    parser.add_argument("--proxy-headers", action=argparse.BooleanOptionalAction, default=True, help="trust X-Forwarded-For from --forwarded-allow-ips (on by default, like uvicorn)")
+    parser.add_argument("--forwarded-allow-ips", default=None, help="default FORWARDED_ALLOW_IPS or 127.0.0.1, like uvicorn")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO))
+    sys.exit(main(args))
@@ -5,4 +5,7 @@ AUTHID_MAX_LENGTH: int = 128
 PID_MIN_LENGTH: int = 16
 PID_MAX_LENGTH: int = 32
 EMAIL_MIN_LENGTH: int = 5
-EMAIL_MAX_LENGTH: int = 255
\ No newline at end of file
+EMAIL_MAX_LENGTH: int = 255
+REVOKED_TOKEN_KEY_LENGTH: int = 32 # uuid4 hex jti
+OPAQUE_REFRESH_TOKEN_LENGTH: int = 40 # ~206 bits, same alphabet as pid/authid
+OPAQUE_REFRESH_TOKEN_HASH_LENGTH: int = 64 # sha256 hex
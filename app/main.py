@@ -1,7 +1,86 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_config
+from app.models.user import UserModel
+from app.models.revoked_token import RevokedTokenModel
+from app.utils.revocation_cache_util import get_revocation_cache
+from app.utils.invalidation_util import get_invalidation_bus
+from app.utils.reaper_util import get_reaper
+from app.utils.db_util import get_engine, get_replica_set, warmup_pool, dispose_engine
+from app.utils.jwk_util import get_keyring
+from app.utils.bcrypt_util import get_password_hash_pool
+from app.utils.metrics_util import MetricsMiddleware, run_loop_lag_monitor, mark_process_dead
+from app.api.auth import router as auth_router
+from app.api.protected import router as protected_router
+from app.api.well_known import router as well_known_router
+
+logger = logging.getLogger(__name__)
+
+
+async def _warm_up_queries(session: AsyncSession) -> None:
+    # the statements behind login, AuthRequired and /refresh, with values that match nothing
+    # sqlalchemy compiles and caches them, asyncpg prepares them on this connection
+    await UserModel.get_login_credentials(session, "warmup@example.invalid")
+    await UserModel.get_principal_by_authid(session, "")
+    await RevokedTokenModel.get_by_value(session, "")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = get_config()
+
+    if config.DB_POOL_WARMUP > 0:
+        await warmup_pool(get_engine(), config.DB_POOL_WARMUP, _warm_up_queries)
+
+    background_tasks = []
+    replica_set = get_replica_set()
+    if replica_set.enabled:
+        # replicas take reads once a check found them caught up, until then everything goes to the primary
+        await replica_set.check()
+        if config.DB_POOL_WARMUP > 0:
+            for replica in replica_set.replicas:
+                if replica.healthy:
+                    await warmup_pool(replica.engine, config.DB_POOL_WARMUP, _warm_up_queries)
+        background_tasks.append(asyncio.create_task(replica_set.run_health_check_loop()))
 
-app = FastAPI()
+    if config.INVALIDATION_BUS_ENABLED:
+        # listening before the rebuild, so no revocation falls between the two
+        # never fatal, run_forever keeps retrying (and resyncs once it gets through)
+        invalidation_bus = get_invalidation_bus()
+        try:
+            await invalidation_bus.connect()
+        except Exception as e:
+            logger.warning("Unable to start invalidation bus: %s", e)
+        background_tasks.append(asyncio.create_task(invalidation_bus.run_forever()))
+
+    revocation_cache = get_revocation_cache()
+    await revocation_cache.rebuild_from_db()
+    background_tasks.append(asyncio.create_task(revocation_cache.run_rebuild_loop(config.REVOCATION_CACHE_REBUILD_MINUTES * 60)))
+    if config.REAPER_ENABLED:
+        background_tasks.append(asyncio.create_task(get_reaper().run_forever(config.REAPER_INTERVAL_SECONDS)))
+
+    if config.JWT_ACCESS_ALGORITHM is not None:
+        keyring = get_keyring()
+        await keyring.refresh_from_db()
+        background_tasks.append(asyncio.create_task(keyring.run_refresh_loop(config.JWT_KEY_REFRESH_SECONDS)))
+
+    if config.METRICS_ENABLED:
+        background_tasks.append(asyncio.create_task(run_loop_lag_monitor(config.METRICS_LOOP_LAG_INTERVAL_SECONDS)))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    # in flight requests are done by now (uvicorn drains them before the lifespan shutdown)
+    get_password_hash_pool().shutdown()
+    await dispose_engine()
+    mark_process_dead()
 
 
 # ==== CORS SETTINGS FOR DEVELOPMENT ONLY ==== #
@@ -12,20 +91,33 @@ DEV_ORIGINS = [
     "http://0.0.0.0:5000",
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=DEV_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"], 
-)
 
+def create_app() -> FastAPI:
+    # no connections are made here, the engine is created by the first request or the lifespan
+    # uvicorn --factory app.main:create_app, or python -m app.cli.serve to preload before forking workers
+    app = FastAPI(lifespan=lifespan)
 
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=DEV_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"], 
+    )
 
+    # outermost, so latency covers everything below it
+    if get_config().METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
 
+    app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
+    app.include_router(protected_router, prefix="/api/protected", tags=["Protected"])
+    app.include_router(well_known_router, prefix="/.well-known", tags=["Well Known"])
+
+    if get_config().INTERNAL_ENDPOINTS_ENABLED:
+        from app.api.internal import router as internal_router
+        app.include_router(internal_router, prefix="/api/internal", tags=["Internal"], include_in_schema=False)
+    return app
 
-from app.api.auth import router as auth_router
-from app.api.protected import router as protected_router
 
-app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
-app.include_router(protected_router, prefix="/api/protected", tags=["Protected"])
+# uvicorn app.main:app
+app = create_app()
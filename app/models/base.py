@@ -1,11 +1,13 @@
 from datetime import datetime
-from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase
+from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, noload, raiseload, make_transient_to_detached
+from sqlalchemy.orm.interfaces import ONETOMANY
 from sqlalchemy import TIMESTAMP, BigInteger
 from sqlalchemy.sql import func
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from typing import TypeVar, Type
+from typing import Any, TypeVar, Type
 from app.utils.result_util import Result, Ok, Error
 
 T = TypeVar("T", bound="BaseModel")
@@ -16,6 +18,52 @@ class BaseModel(DeclarativeBase):
         TIMESTAMP(timezone=True), server_default=func.now(), nullable=False
     )
 
+    @classmethod
+    def _returning_load_options(cls) -> list:
+        # a row that was just inserted can not be referenced by anything yet, so one-to-many sides are empty
+        # anything else was not loaded and raises instead of lazy loading (which fails under asyncio)
+        return [
+            noload(relationship) if relationship.direction is ONETOMANY else raiseload(relationship)
+            for relationship in cls.__mapper__.relationships
+        ]
+
+    @classmethod
+    async def insert_returning(
+            cls: Type[T], 
+            session: AsyncSession, 
+            values: dict[str, Any], 
+            load_fields: bool = True, 
+            on_conflict_do_nothing: bool = False
+        ) -> Result[T|None, SQLAlchemyError]:
+        """
+        One INSERT ... RETURNING instead of add() + flush() + refresh().
+        load_fields=True returns the persistent object with server defaults (id, datetime_created) filled in.
+        load_fields=False only reads back the primary key, the returned object is detached and
+        anything not in values is left unloaded.
+        With on_conflict_do_nothing a unique violation returns Ok(None).
+        """
+        try:
+            stmt = insert(cls).values(**values)
+            if on_conflict_do_nothing:
+                stmt = stmt.on_conflict_do_nothing()
+
+            if load_fields:
+                stmt = stmt.returning(cls).options(*cls._returning_load_options())
+                result = await session.execute(stmt)
+                return Ok(result.scalar_one_or_none())
+
+            stmt = stmt.returning(*cls.__mapper__.primary_key)
+            result = await session.execute(stmt)
+            row = result.one_or_none()
+            if row is None:
+                return Ok(None)
+
+            new_obj = cls(**values, **row._asdict())
+            make_transient_to_detached(new_obj)
+            return Ok(new_obj)
+        except SQLAlchemyError as e:
+            return Error(e)
+
 
 class BaseModelWithId(BaseModel):
     __abstract__ = True
@@ -37,14 +85,7 @@ class ValueBaseModel(BaseModelWithId):
 
     @classmethod
     async def create(cls: Type[T], session: AsyncSession, value: str) -> Result[T, SQLAlchemyError]:
-        try:
-            new_obj = cls(value=value)
-            session.add(new_obj) # caller commits
-            await session.flush()
-            await session.refresh(new_obj)
-            return Ok(new_obj)
-        except SQLAlchemyError as e:
-            return Error(e)
+        return await cls.insert_returning(session=session, values={"value": value}) # caller commits
 
 
     @classmethod
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from app.models.base import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import String, Float, Integer, DateTime, select, update, delete, func, case, and_, or_
+from app.utils.result_util import Result, Ok, Error
+
+# state for the postgres rate limit backend, one row per throttled key (see rate_limit_util)
+# times come from the database clock so every worker agrees on them
+class RateLimitModel(BaseModel):
+    __tablename__ = "rate_limit_model"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True) # scope:kind:digest
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    datetime_updated: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False) # tokens were last refilled
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    datetime_failure: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True) # last failure
+    datetime_blocked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    datetime_ttl: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
+    @classmethod
+    def _refilled(cls, capacity: float, refill_per_second: float):
+        elapsed = func.extract("epoch", func.now() - cls.datetime_updated)
+        return func.least(capacity, cls.tokens + elapsed * refill_per_second)
+
+
+    @classmethod
+    async def take(cls: RateLimitModel, session: AsyncSession, key: str, capacity: float, refill_per_second: float, ttl: timedelta) -> Result[float, SQLAlchemyError]:
+        # Ok(0.0) if a token was taken, otherwise Ok(seconds until the key may try again)
+        try:
+            now = func.now()
+            refilled = cls._refilled(capacity, refill_per_second)
+            not_blocked = or_(cls.datetime_blocked_until.is_(None), cls.datetime_blocked_until <= now)
+
+            # the common (allowed) case is this one statement, a denied upsert updates nothing and returns no row
+            stmt = (
+                insert(cls)
+                .values(key=key, tokens=capacity - 1, datetime_updated=now, datetime_ttl=now + ttl)
+                .on_conflict_do_update(
+                    index_elements=[cls.key],
+                    set_={
+                        "tokens": refilled - 1,
+                        "datetime_updated": now,
+                        "datetime_ttl": func.greatest(cls.datetime_ttl, now + ttl),
+                    },
+                    where=and_(refilled >= 1, not_blocked)
+                )
+                .returning(cls.key)
+            )
+            result = await session.execute(stmt)
+            if result.scalar_one_or_none() is not None:
+                return Ok(0.0)
+
+            retry_stmt = select(
+                func.greatest(
+                    (1 - refilled) / refill_per_second,
+                    func.extract("epoch", func.coalesce(cls.datetime_blocked_until, now) - now),
+                    0
+                )
+            ).where(cls.key == key)
+            result = await session.execute(retry_stmt)
+            return Ok(float(result.scalar_one_or_none() or 0.0))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def record_failure(
+            cls: RateLimitModel,
+            session: AsyncSession,
+            key: str,
+            free_failures: int,
+            base_seconds: float,
+            max_seconds: float,
+            reset_after: timedelta
+        ) -> Result[float, SQLAlchemyError]:
+        # Ok(seconds the key is now blocked for), 0.0 while it is within its free failures
+        try:
+            now = func.now()
+            failures = case(
+                (or_(cls.datetime_failure.is_(None), cls.datetime_failure <= now - reset_after), 1),
+                else_=cls.failures + 1
+            )
+            # base, 2x base, 4x base... for every failure past the free ones
+            backoff = func.least(max_seconds, base_seconds * func.power(2, failures - free_failures - 1))
+            stmt = (
+                update(cls)
+                .where(cls.key == key)
+                .values(
+                    failures=failures,
+                    datetime_failure=now,
+                    datetime_blocked_until=case(
+                        (failures > free_failures, now + func.make_interval(0, 0, 0, 0, 0, 0, backoff)),
+                        else_=cls.datetime_blocked_until
+                    ),
+                    datetime_ttl=func.greatest(cls.datetime_ttl, now + reset_after, now + func.make_interval(0, 0, 0, 0, 0, 0, max_seconds))
+                )
+                .returning(func.greatest(func.extract("epoch", func.coalesce(cls.datetime_blocked_until, now) - now), 0))
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            return Ok(float(result.scalar_one_or_none() or 0.0))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def reset_failures(cls: RateLimitModel, session: AsyncSession, key: str) -> Result[None, SQLAlchemyError]:
+        try:
+            stmt = (
+                update(cls)
+                .where(cls.key == key, cls.failures > 0)
+                .values(failures=0, datetime_failure=None, datetime_blocked_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await session.execute(stmt)
+            return Ok(None)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def delete_expired(cls: RateLimitModel, session: AsyncSession, before: datetime, limit: int) -> Result[int, SQLAlchemyError]:
+        # same batching as RevokedTokenModel.delete_expired
+        try:
+            expired_keys = (
+                select(cls.key)
+                .where(cls.datetime_ttl < before)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            stmt = delete(cls).where(cls.key.in_(expired_keys)).execution_options(synchronize_session=False)
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
+        except SQLAlchemyError as e:
+            return Error(e)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+from datetime import datetime
+from app.models.base import BaseModelWithId
+from app.models.user import UserModel, AuthidModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import String, BigInteger, DateTime, ForeignKey, select, update, delete, literal, func
+from app.constants import OPAQUE_REFRESH_TOKEN_HASH_LENGTH
+from app.utils.result_util import Result, Ok, Error
+from app.utils.principal_cache_util import Principal
+
+# opaque refresh tokens (REFRESH_TOKEN_MODE=opaque), one row per issued token
+# every /refresh uses up its row and issues the next one in the same family,
+# a used row stays until it expires so presenting it again is detected as reuse
+class RefreshSessionModel(BaseModelWithId):
+    __tablename__ = "refresh_session_model"
+
+    token_hash: Mapped[str] = mapped_column(String(OPAQUE_REFRESH_TOKEN_HASH_LENGTH), nullable=False, unique=True)
+    family_id: Mapped[str] = mapped_column(String(32), nullable=False, index=True) # uuid4 hex, shared by a login and its refreshes
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("user_model.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    datetime_used: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True) # exchanged for the next token
+    datetime_revoked: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True) # logout, logout-all or reuse
+    datetime_ttl: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True) # token expiry, reaped after
+
+
+    @classmethod
+    async def issue(cls: RefreshSessionModel, session: AsyncSession, token_hash: str, family_id: str, user_id: int, ttl: datetime) -> Result[None, SQLAlchemyError]:
+        # login/signup, the start of a new family
+        try:
+            stmt = insert(cls).values(token_hash=token_hash, family_id=family_id, user_id=user_id, datetime_ttl=ttl)
+            await session.execute(stmt)
+            return Ok(None)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def rotate(cls: RefreshSessionModel, session: AsyncSession, token_hash: str, new_token_hash: str, ttl: datetime) -> Result[Principal|None, SQLAlchemyError]:
+        # /refresh in one statement: use up the presented token, issue the next one in its family
+        # and load the principal for the new access token
+        # Ok(None) if the token is unknown, expired, revoked or already used (see revoke_family_if_reused)
+        try:
+            now = func.now()
+            used = (
+                update(cls)
+                .where(
+                    cls.token_hash == token_hash,
+                    cls.datetime_used.is_(None),
+                    cls.datetime_revoked.is_(None),
+                    cls.datetime_ttl > now
+                )
+                .values(datetime_used=now)
+                .returning(cls.family_id, cls.user_id)
+                .cte("used")
+            )
+            next_session = (
+                insert(cls)
+                .from_select(
+                    ["token_hash", "family_id", "user_id", "datetime_ttl"],
+                    select(literal(new_token_hash), used.c.family_id, used.c.user_id, literal(ttl))
+                )
+                .cte("next_session")
+            )
+            stmt = (
+                select(
+                    UserModel.id, AuthidModel.value, UserModel.firstname, UserModel.lastname, UserModel.pid,
+                    UserModel.email, UserModel.datetime_deactivated, UserModel.datetime_deleted
+                )
+                .select_from(used)
+                .join(UserModel, UserModel.id == used.c.user_id)
+                .join(AuthidModel, UserModel.authid_id == AuthidModel.id)
+                .add_cte(next_session) # not referenced, postgres runs data modifying ctes anyway
+            )
+            result = await session.execute(stmt)
+            row = result.one_or_none()
+            if row is None:
+                return Ok(None)
+            return Ok(Principal(
+                id=row.id,
+                authid_value=row.value,
+                firstname=row.firstname,
+                lastname=row.lastname,
+                pid=row.pid,
+                email=row.email,
+                datetime_deactivated=row.datetime_deactivated,
+                datetime_deleted=row.datetime_deleted
+            ))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def revoke_family_if_reused(cls: RefreshSessionModel, session: AsyncSession, token_hash: str) -> Result[int, SQLAlchemyError]:
+        # a used token coming back means it was copied, whoever holds the newest one may be the thief,
+        # so the whole family goes. Ok(rows revoked), 0 if the token was not a used one
+        try:
+            family = select(cls.family_id).where(cls.token_hash == token_hash, cls.datetime_used.is_not(None)).scalar_subquery()
+            stmt = (
+                update(cls)
+                .where(cls.family_id == family, cls.datetime_revoked.is_(None))
+                .values(datetime_revoked=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def revoke_family(cls: RefreshSessionModel, session: AsyncSession, token_hash: str) -> Result[int, SQLAlchemyError]:
+        # logout, ends the session the token belongs to (used or not)
+        try:
+            family = select(cls.family_id).where(cls.token_hash == token_hash).scalar_subquery()
+            stmt = (
+                update(cls)
+                .where(cls.family_id == family, cls.datetime_revoked.is_(None))
+                .values(datetime_revoked=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def revoke_all(cls: RefreshSessionModel, session: AsyncSession, user_id: int) -> Result[int, SQLAlchemyError]:
+        # logout-all, the authid rotation does not reach these since they point at the user
+        try:
+            stmt = (
+                update(cls)
+                .where(cls.user_id == user_id, cls.datetime_revoked.is_(None), cls.datetime_ttl > func.now())
+                .values(datetime_revoked=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def delete_expired(cls: RefreshSessionModel, session: AsyncSession, before: datetime, limit: int) -> Result[int, SQLAlchemyError]:
+        # same as RevokedTokenModel.delete_expired
+        try:
+            expired_ids = (
+                select(cls.id)
+                .where(cls.datetime_ttl < before)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            stmt = delete(cls).where(cls.id.in_(expired_ids)).execution_options(synchronize_session=False)
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
+        except SQLAlchemyError as e:
+            return Error(e)
@@ -1,27 +1,153 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from app.models.base import ValueBaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import select
-from sqlalchemy import String, DateTime
+from sqlalchemy import String, DateTime, select, delete, text
+from app.constants import REVOKED_TOKEN_KEY_LENGTH
 from app.utils.result_util import Result, Ok, Error
+from app.utils.revocation_cache_util import get_revocation_cache
+from app.utils.db_util import run_after_commit
+from app.utils.invalidation_util import get_invalidation_bus
 
 class RevokedTokenModel(ValueBaseModel):
     __tablename__ = "revoked_token_model"
-    value: Mapped[str] = mapped_column(String(2048))
-    datetime_ttl: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    # value is the token's revocation key (see JwtUtil.get_revocation_key), not the token itself
+    value: Mapped[str] = mapped_column(String(REVOKED_TOKEN_KEY_LENGTH), nullable=False, unique=True)
+    datetime_ttl: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
 
     @classmethod
     async def create(cls: RevokedTokenModel, session: AsyncSession, value: str, ttl: datetime) -> Result[RevokedTokenModel, SQLAlchemyError]:
+        return await cls.insert_returning(session=session, values={"value": value, "datetime_ttl": ttl})
+
+
+    @classmethod
+    async def is_revoked(cls: RevokedTokenModel, session: AsyncSession, value: str) -> Result[bool, SQLAlchemyError]:
+        # most answers come from the in-process cache, only unknown keys hit the db
+        cache = get_revocation_cache()
+        cached = cache.check(value)
+        if cached is not None:
+            return Ok(cached)
+
+        revoked_token_result = await cls.get_by_value(session=session, value=value)
+        if isinstance(revoked_token_result, Error):
+            return revoked_token_result
+
+        revoked_token: RevokedTokenModel | None = revoked_token_result.data
+        cache.record_lookup(value, revoked_token.datetime_ttl if revoked_token else None)
+        return Ok(revoked_token is not None)
+
+
+    @classmethod
+    async def revoke(cls: RevokedTokenModel, session: AsyncSession, value: str, ttl: datetime) -> Result[bool, SQLAlchemyError]:
+        # single insert-or-ignore, no select beforehand
+        # Ok(True) if this call revoked it, Ok(False) if it was already revoked
+        cache = get_revocation_cache()
+        if cache.check(value) is True:
+            return Ok(False)
+
+        # nothing on the write path reads the row back, only the id is returned
+        insert_result = await cls.insert_returning(
+            session=session,
+            values={"value": value, "datetime_ttl": ttl},
+            load_fields=False,
+            on_conflict_do_nothing=True
+        )
+        if isinstance(insert_result, Error):
+            return insert_result
+
+        revoked = insert_result.data is not None
+        if revoked:
+            run_after_commit(session, lambda: cache.add(value, ttl))
+            run_after_commit(session, lambda: get_invalidation_bus().revoked(value, ttl)) # the other workers
+        return Ok(revoked)
+
+
+    @classmethod
+    async def delete_expired(cls: RevokedTokenModel, session: AsyncSession, before: datetime, limit: int) -> Result[int, SQLAlchemyError]:
+        # bounded batch, rows locked by another reaper are skipped instead of waited on
         try:
-            new_obj = cls(value=value, datetime_ttl=ttl)
-            session.add(new_obj)
-            await session.flush()
-            await session.refresh(new_obj)
-            return Ok(new_obj)
+            expired_ids = (
+                select(cls.id)
+                .where(cls.datetime_ttl < before)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            stmt = delete(cls).where(cls.id.in_(expired_ids)).execution_options(synchronize_session=False)
+            result = await session.execute(stmt)
+            return Ok(result.rowcount)
         except SQLAlchemyError as e:
             return Error(e)
 
 
+    # partition maintenance, only used when the table was partitioned by the optional migration
+    # daily partitions are named revoked_token_model_pYYYYMMDD and cover [day, day + 1)
+
+    @classmethod
+    async def is_partitioned(cls: RevokedTokenModel, session: AsyncSession) -> Result[bool, SQLAlchemyError]:
+        try:
+            stmt = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))")
+            result = await session.execute(stmt, {"table": cls.__tablename__})
+            return Ok(bool(result.scalar()))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def get_partition_days(cls: RevokedTokenModel, session: AsyncSession) -> Result[list[date], SQLAlchemyError]:
+        try:
+            stmt = text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:table)"
+            )
+            result = await session.execute(stmt, {"table": cls.__tablename__})
+            prefix = f"{cls.__tablename__}_p"
+            days = [
+                datetime.strptime(name.removeprefix(prefix), "%Y%m%d").date()
+                for name in result.scalars()
+                if name.startswith(prefix)
+            ]
+            return Ok(sorted(days))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def create_partition(cls: RevokedTokenModel, session: AsyncSession, day: date) -> Result[str, SQLAlchemyError]:
+        # the day's rows may already sit in the default partition (revoked before the partition existed,
+        # i.e. a ttl further out than REAPER_PARTITION_PREMAKE_DAYS or the reaper was down), postgres
+        # refuses a PARTITION OF for a range the default holds rows of. So the table is created on its own,
+        # those rows are moved into it and then it is attached (which creates the indexes of the parent)
+        try:
+            name = f"{cls.__tablename__}_p{day:%Y%m%d}"
+            start = f"{day.isoformat()} 00:00:00+00"
+            end = f"{(day + timedelta(days=1)).isoformat()} 00:00:00+00"
+            exists = await session.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+            if exists:
+                return Ok(name)
+
+            await session.execute(text(f"CREATE TABLE {name} (LIKE {cls.__tablename__} INCLUDING DEFAULTS)"))
+            await session.execute(text(
+                f"WITH moved AS ("
+                f"DELETE FROM {cls.__tablename__}_default WHERE datetime_ttl >= '{start}' AND datetime_ttl < '{end}' RETURNING *"
+                f") INSERT INTO {name} SELECT * FROM moved"
+            ))
+            await session.execute(text(
+                f"ALTER TABLE {cls.__tablename__} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+            ))
+            return Ok(name)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def drop_partition(cls: RevokedTokenModel, session: AsyncSession, day: date) -> Result[str, SQLAlchemyError]:
+        try:
+            name = f"{cls.__tablename__}_p{day:%Y%m%d}"
+            await session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            return Ok(name)
+        except SQLAlchemyError as e:
+            return Error(e)
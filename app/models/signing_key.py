@@ -0,0 +1,43 @@
+from __future__ import annotations
+from datetime import datetime
+from app.models.base import BaseModelWithId
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import String, Text, DateTime, select, text
+from app.utils.result_util import Result, Ok, Error
+
+# only one worker rotates keys at a time
+SIGNING_KEY_ADVISORY_LOCK_KEY = 0x6A776B73 # "jwks"
+
+class SigningKeyModel(BaseModelWithId):
+    __tablename__ = "signing_key_model"
+
+    kid: Mapped[str] = mapped_column(String(32), nullable=False, unique=True)
+    algorithm: Mapped[str] = mapped_column(String(16), nullable=False)
+    private_key: Mapped[str] = mapped_column(Text, nullable=False) # pem, encrypted with SECRET_KEY
+    public_jwk: Mapped[str] = mapped_column(Text, nullable=False) # json
+
+    datetime_activated: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False) # starts signing
+    datetime_expires: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False) # stops signing
+    datetime_ttl: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False) # stops verifying, leaves the jwks
+
+
+    @classmethod
+    async def get_all_unexpired(cls: SigningKeyModel, session: AsyncSession, now: datetime) -> Result[list[SigningKeyModel], SQLAlchemyError]:
+        try:
+            stmt = select(cls).where(cls.datetime_ttl > now).order_by(cls.datetime_activated)
+            result = await session.execute(stmt)
+            return Ok(list(result.scalars()))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def lock_for_rotation(cls: SigningKeyModel, session: AsyncSession) -> Result[None, SQLAlchemyError]:
+        # transaction scoped, other workers wait and then see the key this one created
+        try:
+            await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SIGNING_KEY_ADVISORY_LOCK_KEY})
+            return Ok(None)
+        except SQLAlchemyError as e:
+            return Error(e)
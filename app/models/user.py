@@ -1,10 +1,13 @@
 from __future__ import annotations
-from sqlalchemy import BigInteger, String, DateTime, ForeignKey
-from sqlalchemy.sql import func, select
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import BigInteger, String, DateTime, ForeignKey, text
+from sqlalchemy.sql import func, select, update, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Mapped, mapped_column, relationship, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
+from dataclasses import dataclass
 from app.models.base import BaseModelWithId, ValueBaseModel
 from app.constants import (
     PID_MAX_LENGTH, PID_MIN_LENGTH,
@@ -16,9 +19,22 @@ from app.schemas.auth import SignupRequestSchema
 from app.utils.result_util import Result, Ok, Error
 from app.utils.string_util import StringUtil
 from app.utils.bcrypt_util import BcryptUtil
+from app.utils.principal_cache_util import Principal, get_principal_cache
+from app.utils.db_util import run_after_commit, get_replica_set
+from app.utils.invalidation_util import get_invalidation_bus
 
 # postgresql is case sensitive A != a
 
+
+@dataclass(frozen=True)
+class LoginCredentials:
+    # what login needs, nothing else is loaded
+    user_id: int
+    authid_value: str
+    password: str # bcrypt hash
+    datetime_deactivated: datetime | None
+    datetime_deleted: datetime | None
+
 class AuthidModel(ValueBaseModel):
     __tablename__ = "authid_model"
 
@@ -34,6 +50,36 @@ class AuthidModel(ValueBaseModel):
         single_parent=True  # Ensures only one user per authid
     )
 
+    @classmethod
+    async def rotate(cls: AuthidModel, session: AsyncSession, authid_value: str) -> Result[str|None, Exception]:
+        # log out everywhere: every access/refresh token carries the authid as sub,
+        # a new value makes all of them fail the principal lookup, nothing goes into revoked_token_model
+        # Ok(new value), Ok(None) if there was no such authid (already rotated by a concurrent call)
+        new_value_result = StringUtil().generate_random(min_length=AUTHID_MIN_LENGTH, max_length=AUTHID_MAX_LENGTH)
+        if isinstance(new_value_result, Error):
+            return new_value_result
+        new_value = new_value_result.data
+
+        try:
+            stmt = (
+                update(cls)
+                .where(cls.value == authid_value)
+                .values(value=new_value)
+                .returning(cls.id)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            rotated = result.scalar_one_or_none() is not None
+        except SQLAlchemyError as e:
+            return Error(e)
+
+        # same as UserModel.update_status, the old value must not be served from the cache
+        principal_cache = get_principal_cache()
+        principal_cache.invalidate(authid_value)
+        run_after_commit(session, lambda: principal_cache.invalidate(authid_value))
+        run_after_commit(session, lambda: get_invalidation_bus().principal_changed(authid_value)) # the other workers
+        return Ok(new_value if rotated else None)
+
 
 class UserModel(BaseModelWithId):
     __tablename__ = "user_model"
@@ -65,78 +111,113 @@ class UserModel(BaseModelWithId):
     
 
     @classmethod
-    async def create(cls: UserModel, session: AsyncSession, data: SignupRequestSchema) -> Result[UserModel, SQLAlchemyError]:
+    async def create(cls: UserModel, session: AsyncSession, data: SignupRequestSchema) -> Result[UserModel|None, Exception]:
+        # Ok(None) means the email is already in use
+        # pid and authid are high entropy random values, the unique constraints catch the (practically impossible) collision
         try:
-
             string_util = StringUtil()
-            
-            # pid
-            counter = 0
-            while True:
-                if counter > 4:
-                    raise ValueError("Try limit has been reached trying to generate random value for pid.")
-                
-                counter += 1
-
-                pid_value_result = string_util.generate_random(min_length=PID_MIN_LENGTH, max_length=PID_MAX_LENGTH)
-                if isinstance(pid_value_result, Error):
-                    raise ValueError(f"Unable to generate random string as pid value. {pid_value_result.error}")
-                
-                pid_user_result = await cls.get_by_pid(session, pid_value_result.data)
-                if isinstance(pid_user_result, Error):
-                    raise ValueError(f"Unable to determine availability of pid value: {pid_value_result.data}. {pid_user_result.error}")
-                
-                if pid_user_result.data is not None:
-                    continue
-                else:
-                    break
-                
-
-            # authid
-            counter = 0
-            while True:
-                if counter > 4:
-                    raise ValueError("Try limit has been reached trying to create new authid.")
-                
-                counter += 1
-
-                authid_value_result = string_util.generate_random(min_length=AUTHID_MIN_LENGTH, max_length=AUTHID_MAX_LENGTH)
-                if isinstance(authid_value_result, Error):
-                    raise ValueError(f"Unable to generate random string as authid value. {authid_value_result.error}")
-                
-                authid_result = await AuthidModel.get_by_value(session=session, value=authid_value_result.data)
-                if isinstance(authid_result, Error):
-                    raise ValueError(f"Unable to determine availability of authid value: {authid_value_result.data}. {authid_result.error}")
-                
-                if authid_result.data is not None:
-                    continue
-                else:
-                    new_authid_result = await AuthidModel.create(session=session, value=authid_value_result.data)
-                    if isinstance(new_authid_result, Error):
-                        raise ValueError(f"Unable to create new authid. {new_authid_result.error}")
-                    else:
-                        await session.flush(new_authid_result.data)
-                        break
-        
-            # hash password
-            hashed = BcryptUtil().hash_password(data.password)
-            new_user = cls(
-                firstname=data.firstname.title(),
-                lastname=data.lastname.title(),
-                email=data.email.lower(),
-                pid=pid_value_result.data,
-                authid_id=new_authid_result.data.id,
-                password=hashed
+            pid_value = string_util.generate_random(min_length=PID_MIN_LENGTH, max_length=PID_MAX_LENGTH).unwrap_or_raise()
+            authid_value = string_util.generate_random(min_length=AUTHID_MIN_LENGTH, max_length=AUTHID_MAX_LENGTH).unwrap_or_raise()
+
+            # hash before any statement runs, no connection is held while waiting on it
+            hashed = await BcryptUtil().hash_password_async(data.password)
+
+            # authid and user in a single statement
+            # if the email is taken the authid row is still inserted, nothing is returned and the caller's
+            # rollback removes it again (signup checks email_exists first, this only happens on a race)
+            new_authid = (
+                insert(AuthidModel)
+                .values(value=authid_value)
+                .returning(AuthidModel.id)
+                .cte("new_authid")
             )
+            stmt = (
+                insert(cls)
+                .from_select(
+                    ["firstname", "lastname", "email", "pid", "password", "authid_id"],
+                    select(
+                        literal(data.firstname.title()),
+                        literal(data.lastname.title()),
+                        literal(data.email.lower()),
+                        literal(pid_value),
+                        literal(hashed),
+                        new_authid.c.id
+                    )
+                )
+                .on_conflict_do_nothing(index_elements=[cls.email])
+                .returning(cls)
+                .options(*cls._returning_load_options())
+            )
+            result = await session.execute(stmt)
+            new_user = result.scalar_one_or_none()
+            if new_user is None:
+                return Ok(None)
 
-            session.add(new_user)
-            await session.flush()
-            await session.refresh(new_user)
+            # a login right after signup may reach a replica that does not have the user yet
+            email = new_user.email
+            run_after_commit(session, lambda: get_replica_set().mark_written(email))
+
+            # we already know the authid, no need to select it back
+            authid = AuthidModel(id=new_user.authid_id, value=authid_value)
+            make_transient_to_detached(authid)
+            set_committed_value(new_user, "authid", authid)
             return Ok(new_user)
         except Exception as e:
             return Error(e)
 
 
+    @classmethod
+    async def bulk_create(cls: UserModel, session: AsyncSession, rows: list[tuple]) -> Result[list[int], Exception]:
+        # bulk import (app.cli.import_users), rows are
+        # (row_number, firstname, lastname, email, password hash, pid, authid value), already normalized
+        # COPY into a temp table, then authids and users in one statement
+        # Ok(row numbers that were inserted), the rest had an email that is taken (or repeated in rows)
+        try:
+            await session.execute(text(
+                "CREATE TEMP TABLE user_import_staging ("
+                "row_number bigint, firstname text, lastname text, email text, password text, pid text, authid text"
+                ") ON COMMIT DROP"
+            ))
+            # the create above started the transaction, the copy runs inside it
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                "user_import_staging",
+                records=rows,
+                columns=["row_number", "firstname", "lastname", "email", "password", "pid", "authid"]
+            )
+
+            result = await session.execute(text(
+                "WITH fresh AS ("
+                "  SELECT DISTINCT ON (s.email) s.* FROM user_import_staging s"
+                f"  WHERE NOT EXISTS (SELECT 1 FROM {cls.__tablename__} u WHERE u.email = s.email)"
+                "  ORDER BY s.email, s.row_number"
+                "), new_authid AS ("
+                f"  INSERT INTO {AuthidModel.__tablename__} (value) SELECT authid FROM fresh RETURNING id, value"
+                "), new_user AS ("
+                f"  INSERT INTO {cls.__tablename__} (firstname, lastname, email, password, pid, authid_id)"
+                "  SELECT f.firstname, f.lastname, f.email, f.password, f.pid, a.id"
+                "  FROM fresh f JOIN new_authid a ON a.value = f.authid"
+                "  ON CONFLICT (email) DO NOTHING"  # a signup that raced the import
+                "  RETURNING email"
+                ") "
+                "SELECT f.row_number FROM fresh f JOIN new_user n ON n.email = f.email"
+            ))
+            inserted = list(result.scalars())
+
+            # authids whose user hit the conflict above, a separate statement since
+            # the one above can not see its own inserts
+            if len(inserted) < len(rows):
+                await session.execute(text(
+                    f"DELETE FROM {AuthidModel.__tablename__} a USING user_import_staging s "
+                    "WHERE a.value = s.authid "
+                    f"AND NOT EXISTS (SELECT 1 FROM {cls.__tablename__} u WHERE u.authid_id = a.id)"
+                ))
+            return Ok(inserted)
+        except Exception as e: # the copy raises asyncpg errors
+            return Error(e)
+
+
     @classmethod
     async def get_by_email(cls: UserModel, session: AsyncSession, email: str) -> Result[UserModel|None, SQLAlchemyError]:
         try:
@@ -148,6 +229,63 @@ class UserModel(BaseModelWithId):
             return Error(e)
     
 
+    @classmethod
+    async def email_exists(cls: UserModel, session: AsyncSession, email: str) -> Result[bool, SQLAlchemyError]:
+        # signup asks before hashing, a flood of taken emails costs an index lookup each and no hash
+        try:
+            stmt = select(literal(1)).where(cls.email == email.strip().lower())
+            result = await session.execute(stmt)
+            return Ok(result.scalar_one_or_none() is not None)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def get_login_credentials(cls: UserModel, session: AsyncSession, email: str) -> Result[LoginCredentials|None, SQLAlchemyError]:
+        # one joined select of plain columns, no orm objects and no selectin for the authid
+        try:
+            stmt = (
+                select(cls.id, AuthidModel.value, cls.password, cls.datetime_deactivated, cls.datetime_deleted)
+                .join(AuthidModel, cls.authid_id == AuthidModel.id)
+                .where(cls.email == email.strip().lower())
+            )
+            result = await session.execute(stmt)
+            row = result.one_or_none()
+            return Ok(LoginCredentials(*row) if row is not None else None)
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
+    @classmethod
+    async def get_principal_by_authid(cls: UserModel, session: AsyncSession, authid_value: str) -> Result[Principal|None, SQLAlchemyError]:
+        # AuthRequired and /refresh, one joined select of the profile and status columns
+        try:
+            stmt = (
+                select(
+                    cls.id, cls.firstname, cls.lastname, cls.pid, cls.email,
+                    cls.datetime_deactivated, cls.datetime_deleted
+                )
+                .join(AuthidModel, cls.authid_id == AuthidModel.id)
+                .where(AuthidModel.value == authid_value)
+            )
+            result = await session.execute(stmt)
+            row = result.one_or_none()
+            if row is None:
+                return Ok(None)
+            return Ok(Principal(
+                id=row.id,
+                authid_value=authid_value,
+                firstname=row.firstname,
+                lastname=row.lastname,
+                pid=row.pid,
+                email=row.email,
+                datetime_deactivated=row.datetime_deactivated,
+                datetime_deleted=row.datetime_deleted
+            ))
+        except SQLAlchemyError as e:
+            return Error(e)
+
+
     @classmethod
     async def get_by_pid(cls: UserModel, session: AsyncSession, pid: str) -> Result[UserModel|None, SQLAlchemyError]:
         try:
@@ -157,5 +295,50 @@ class UserModel(BaseModelWithId):
             return Ok(user)
         except SQLAlchemyError as e:
             return Error(e)
+    
+
+    @classmethod
+    async def update_password_hash(cls: UserModel, session: AsyncSession, user_id: int, old_hash: str, new_hash: str) -> Result[bool, SQLAlchemyError]:
+        # rehash after login, only replaces the hash that was verified
+        # Ok(False) if the password changed in between, that newer hash is kept
+        try:
+            stmt = (
+                update(cls)
+                .where(cls.id == user_id, cls.password == old_hash)
+                .values(password=new_hash)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(stmt)
+            return Ok(result.rowcount > 0)
+        except SQLAlchemyError as e:
+            return Error(e)
 
 
+    @classmethod
+    async def update_status(
+            cls: UserModel, 
+            session: AsyncSession, 
+            authid_value: str, 
+            datetime_deactivated: datetime | None, 
+            datetime_deleted: datetime | None
+        ) -> Result[bool, SQLAlchemyError]:
+        # the only place user status should change, it keeps the principal cache honest
+        try:
+            stmt = (
+                update(cls)
+                .where(cls.authid_id == AuthidModel.id, AuthidModel.value == authid_value)
+                .values(datetime_deactivated=datetime_deactivated, datetime_deleted=datetime_deleted)
+                .returning(cls.id)
+                .execution_options(synchronize_session="fetch")
+            )
+            result = await session.execute(stmt)
+            updated = result.scalar_one_or_none() is not None
+        except SQLAlchemyError as e:
+            return Error(e)
+
+        # now and after commit, so a concurrent request can not re-cache the old status in between
+        principal_cache = get_principal_cache()
+        principal_cache.invalidate(authid_value)
+        run_after_commit(session, lambda: principal_cache.invalidate(authid_value))
+        run_after_commit(session, lambda: get_invalidation_bus().principal_changed(authid_value)) # the other workers
+        return Ok(updated)
@@ -1,5 +1,5 @@
 from typing_extensions import Self
-from pydantic import Field, BaseModel, EmailStr, model_validator, field_validator
+from pydantic import Field, BaseModel, EmailStr, model_validator
 from app.constants import NAME_MAX_LENGTH, NAME_MIN_LENGTH
 
 class SignupRequestSchema(BaseModel):
@@ -33,6 +33,24 @@ class SignupRequestSchema(BaseModel):
 
 
 
+class ImportUserSchema(BaseModel):
+    # one row of a bulk import (app.cli.import_users), same rules as signup
+    # either a plaintext password or an existing bcrypt hash from the old system
+    firstname: str = Field(..., min_length=NAME_MIN_LENGTH, max_length=NAME_MAX_LENGTH)
+    lastname: str = Field(..., min_length=NAME_MIN_LENGTH, max_length=NAME_MAX_LENGTH)
+    email: EmailStr = Field(..., min_length=5, max_length=255)
+    password: str | None = Field(None, min_length=8, max_length=72)
+    password_hash: str | None = Field(None, pattern=r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$")
+
+    @model_validator(mode='after')
+    def check_one_password(self) -> Self:
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError("Exactly one of password or password_hash is required")
+        if len(self.firstname.strip()) < NAME_MIN_LENGTH or len(self.lastname.strip()) < NAME_MIN_LENGTH:
+            raise ValueError(f"firstname and lastname must be inbetween {NAME_MIN_LENGTH} and {NAME_MAX_LENGTH} characters long.")
+        return self
+
+
 class LoginRequestSchema(BaseModel):
     email: EmailStr
     password: str
@@ -46,4 +64,11 @@ class LoginResponseSchema(BaseModel):
     code: int
 
 class SignupResponseSchema(LoginResponseSchema):
-    pass
\ No newline at end of file
+    pass
+
+class MessageSchema(BaseModel):
+    message: str
+
+class LogoutResponseSchema(BaseModel):
+    payload: MessageSchema
+    code: int
\ No newline at end of file
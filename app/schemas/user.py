@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+class MeSchema(BaseModel):
+    id: int
+    firstname: str
+    lastname: str
+    pid: str
+    email: str
+
+class MeResponseSchema(BaseModel):
+    message: str
+    payload: MeSchema
@@ -1,11 +1,170 @@
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Callable, TypeVar
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from passlib.context import CryptContext
+from app.config import get_config
+from app.utils.metrics_util import observe_password_hash
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+PASSWORD_HASH_SCHEMES = ("bcrypt", "argon2")
+
+
+def build_pwd_context(scheme: str, bcrypt_rounds: int, argon2_time_cost: int, argon2_memory_kib: int, argon2_parallelism: int) -> CryptContext:
+    # the configured scheme hashes, the other one still verifies (hashes from before a switch)
+    # needs_update() flags the other scheme and any hash made with different costs
+    return CryptContext(
+        schemes=[scheme] + [other for other in PASSWORD_HASH_SCHEMES if other != scheme],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds, # without these passlib accepts any rounds as up to date
+        bcrypt__max_rounds=bcrypt_rounds,
+        argon2__rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_kib,
+        argon2__parallelism=argon2_parallelism
+    )
+
+
+@lru_cache() # per process, process pool workers build their own from the same env
+def get_pwd_context() -> CryptContext:
+    config = get_config()
+    return build_pwd_context(
+        scheme=config.PASSWORD_HASH_SCHEME,
+        bcrypt_rounds=config.PASSWORD_HASH_BCRYPT_ROUNDS,
+        argon2_time_cost=config.PASSWORD_HASH_ARGON2_TIME_COST,
+        argon2_memory_kib=config.PASSWORD_HASH_ARGON2_MEMORY_KIB,
+        argon2_parallelism=config.PASSWORD_HASH_ARGON2_PARALLELISM
+    )
+
+
+class PasswordHashPoolSaturatedError(Exception):
+    pass
+
+
+# module level functions so they can be pickled and sent to a process pool
+def _hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+def _verify_password(plain: str, hashed: str) -> bool:
+    return get_pwd_context().verify(plain, hashed)
+
+def _timed(fn: Callable[..., R], *args) -> tuple[R, float]:
+    # timed inside the worker so queue wait is not counted as hashing
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class PasswordHashPool:
+    """
+    Runs the cpu heavy hashing work in a worker pool so it never blocks the event loop.
+    Work beyond max_workers + queue_limit is rejected instead of piling up.
+    """
+
+    def __init__(self, executor_type: str, max_workers: int, queue_limit: int):
+        self.executor_type = executor_type
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor: Executor | None = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Executor:
+        # created lazily so nothing is spawned at import time
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    @property
+    def saturated(self) -> bool:
+        return self._in_flight >= self.max_workers + self.queue_limit
+
+    async def run(self, fn: Callable[..., R], *args) -> R:
+        if self.saturated:
+            self._rejected += 1
+            logger.warning(
+                "Password hash pool saturated: %s in flight (workers=%s, queue_limit=%s)",
+                self._in_flight, self.max_workers, self.queue_limit
+            )
+            raise PasswordHashPoolSaturatedError("Password hash pool is saturated")
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        job = self._get_executor().submit(_timed, fn, *args)
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        # released when the executor is done with the job, not when this caller stops waiting:
+        # a cancelled request (client gone, timeout) leaves a running hash behind that still occupies a worker
+        job.add_done_callback(lambda _: self._job_done(loop))
+
+        # cancelling this only cancels a job that is still queued (its done callback then releases it)
+        result, compute_seconds = await asyncio.wrap_future(job)
+        observe_password_hash(fn.__name__.strip("_"), compute_seconds, time.perf_counter() - started)
+        return result
+
+    def _job_done(self, loop: asyncio.AbstractEventLoop) -> None:
+        # runs in an executor thread, the counter is only touched from the event loop
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass # loop already closed, i.e. jobs finishing after shutdown
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_type,
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.max_workers),
+            "peak_in_flight": self._peak_in_flight,
+            "rejected": self._rejected,
+            "saturated": self.saturated,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+@lru_cache() # one pool per worker process
+def get_password_hash_pool() -> PasswordHashPool:
+    config = get_config()
+    return PasswordHashPool(
+        executor_type=config.PASSWORD_HASH_EXECUTOR,
+        max_workers=config.PASSWORD_HASH_WORKERS,
+        queue_limit=config.PASSWORD_HASH_QUEUE_LIMIT
+    )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 class BcryptUtil:
 
     def hash_password(self, password: str) -> str:
-        return pwd_context.hash(password)
-    
+        return _hash_password(password)
+
     def verify_password(self, plain: str, hashed: str) -> bool:
-        return pwd_context.verify(plain, hashed)
\ No newline at end of file
+        return _verify_password(plain, hashed)
+
+    def needs_update(self, hashed: str) -> bool:
+        # cheap, only parses the hash
+        return get_pwd_context().needs_update(hashed)
+
+    # use these from async code, they raise PasswordHashPoolSaturatedError when the pool is full
+    async def hash_password_async(self, password: str) -> str:
+        return await get_password_hash_pool().run(_hash_password, password)
+
+    async def verify_password_async(self, plain: str, hashed: str) -> bool:
+        return await get_password_hash_pool().run(_verify_password, plain, hashed)
@@ -0,0 +1,144 @@
+import math
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TtlLruCache(Generic[K, V]):
+    """
+    Bounded LRU where every entry also carries its own expiry (epoch seconds).
+    Not thread safe, meant to be used from a single event loop.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._data: OrderedDict[K, tuple[V, float]] = OrderedDict()
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, expires_at: float) -> None:
+        if expires_at <= time.time():
+            return
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# handed to the waiters of a call whose caller was cancelled or raised, they load for themselves
+_RETRY = object()
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Concurrent do() calls for the same key share one call of load: the first caller runs it,
+    the ones arriving while it is in flight wait for and return the same value (or raise the same error).
+    Nothing is kept once the call finishes, so there is no staleness beyond the call itself.
+    Not thread safe, meant to be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._calls: dict[K, asyncio.Future] = {}
+        self.calls = 0     # loads that ran
+        self.coalesced = 0 # do() calls answered by someone else's load
+
+    async def do(self, key: K, load: Callable[[], Awaitable[V]]) -> V:
+        while (future := self._calls.get(key)) is not None:
+            self.coalesced += 1
+            # shielded, a waiter going away must not cancel the call for the others
+            value = await asyncio.shield(future)
+            if value is not _RETRY:
+                return value
+            self.coalesced -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.calls += 1
+        value = _RETRY
+        try:
+            value = await load()
+            return value
+        except Exception as e:
+            # the waiters get the same error instead of each running load again after it
+            future.set_exception(e)
+            future.exception() # nobody may be waiting, keeps asyncio from logging it as never retrieved
+            raise
+        finally:
+            # a cancellation belongs to this caller alone, the waiters retry instead
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            if not future.done():
+                future.set_result(value)
+
+    def forget(self, key: K) -> None:
+        # calls for key from now on start a new load instead of joining the one in flight
+        # (i.e. it was started before a write the caller must see)
+        self._calls.pop(key, None)
+
+    def clear(self) -> None:
+        self._calls.clear()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class BloomFilter:
+    """
+    Answers "definitely not added" or "maybe added".
+    Never gives false negatives, false positives are bounded by the sizing.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float, max_bytes: int):
+        capacity = max(1, capacity)
+        optimal_bits = int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+        self.size = max(8, min(optimal_bits, max_bytes * 8))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        # double hashing, two 64 bit halves of one digest give all k positions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
@@ -1,19 +1,296 @@
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from app.config import get_config
+import time
+import asyncio
+import logging
+from uuid import uuid4
+from functools import lru_cache, cached_property
+from typing import Annotated, AsyncGenerator, Awaitable, Callable, TypeVar
+from fastapi import Depends
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncConnection, AsyncEngine
+from app.config import Config, get_config
+from app.utils.metrics_util import DB_POOL_CHECKOUT_WAIT, DB_POOL_TIMEOUTS, instrument_engine
+from app.utils.result_util import Result, Error
+from app.utils.cache_util import TtlLruCache
 
-engine = create_async_engine(
-    get_config().DATABASE_URL, 
-    echo=False,  # TODO: False on prod
-    future=True
-)
+logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-AsyncSessionLocal = async_sessionmaker(
-    engine, 
-    class_=AsyncSession, 
-    expire_on_commit=False
-)
+
+class PoolMetrics:
+    # one per engine, the primary's and every replica's pool count on their own
+
+    def __init__(self, pool_label: str):
+        self.pool_label = pool_label
+        self._checkout_wait = DB_POOL_CHECKOUT_WAIT.labels(pool=pool_label)
+        self._timeouts = DB_POOL_TIMEOUTS.labels(pool=pool_label)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        self._checkout_wait.observe(seconds)
+
+    def record_timeout(self) -> None:
+        self.timeouts += 1
+        self._timeouts.inc()
+
+
+class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    # times how long a checkout waits for a free connection (includes connecting a new one)
+    # metrics is set by _create_engine, right after the engine (and so the pool) is created
+    metrics: PoolMetrics
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started)
+
+    def recreate(self) -> "InstrumentedAsyncAdaptedQueuePool":
+        # the engine swaps in a new pool after dispose() or a disconnect, the numbers carry over
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _engine_options(config: Config) -> dict:
+    options = {
+        "poolclass": InstrumentedAsyncAdaptedQueuePool,
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+    if config.DB_PGBOUNCER_MODE:
+        # pgbouncer in transaction pooling mode can hand every transaction a different server connection,
+        # so prepared statements must not be cached per connection and need names that never collide
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return options
+
+
+def _create_engine(url: str, pool_label: str, **kwargs) -> AsyncEngine:
+    engine = create_async_engine(url, **kwargs, **_engine_options(get_config()))
+    engine.sync_engine.pool.metrics = PoolMetrics(pool_label)
+    if get_config().METRICS_ENABLED:
+        instrument_engine(engine, pool_label)
+    return engine
+
+
+@lru_cache() # created on first use, never at import: serve.py imports everything before forking workers
+def get_engine() -> AsyncEngine:
+    return _create_engine(
+        get_config().DATABASE_URL, 
+        "primary",
+        echo=False,  # TODO: False on prod
+        future=True
+    )
+
+
+@lru_cache()
+def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(
+        get_engine(), 
+        class_=AsyncSession, 
+        expire_on_commit=False
+    )
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    # was the sessionmaker itself, still called the same way
+    return get_sessionmaker()()
+
+
+# replay lag of a replica in seconds, 0 when it has replayed everything it received
+# (pg_last_xact_replay_timestamp alone keeps growing while the primary has nothing to send)
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    # one read replica, the engine is created on first use like the primary's
+
+    def __init__(self, url: str, max_errors: int, pool_label: str):
+        self.url = url
+        self.pool_label = pool_label
+        self.max_errors = max_errors
+        self.healthy = False # until the first health check says otherwise
+        self.lag_seconds: float | None = None
+        self.last_error: str | None = None
+        self.errors_since_check = 0
+        self.reads = 0
+        self.errors = 0
+
+    @property
+    def name(self) -> str:
+        # for logs and stats, never the password (a unix socket host comes in the query string)
+        url = make_url(self.url)
+        host = url.host or url.query.get("host") or "localhost"
+        port = url.port or url.query.get("port") or 5432
+        return f"{host}:{port}/{url.database}"
+
+    @cached_property
+    def engine(self) -> AsyncEngine:
+        engine = _create_engine(self.url, self.pool_label)
+
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def _handle_error(exception_context):
+            self.record_error(exception_context.original_exception)
+
+        return engine
+
+    @cached_property
+    def sessionmaker(self) -> async_sessionmaker[AsyncSession]:
+        return async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def record_error(self, error: BaseException) -> None:
+        self.errors += 1
+        self.errors_since_check += 1
+        self.last_error = str(error)
+        if self.healthy and self.errors_since_check >= self.max_errors:
+            self.healthy = False
+            logger.warning("Replica %s out of rotation after %s errors: %s", self.name, self.errors_since_check, error)
+
+
+class ReplicaSet:
+    """
+    Read replicas for read only lookups (ReadRouter), picked round robin among the healthy ones.
+
+    A replica leaves the rotation when a health check measures more than max_lag_seconds of replay
+    lag or fails, or after max_errors errors between two checks, and comes back with the first
+    check that finds it caught up. With no replica healthy (or none configured) reads go to the primary.
+    """
+
+    def __init__(self, urls: list[str], max_lag_seconds: float, max_errors: int, health_check_seconds: float):
+        self.replicas = [Replica(url, max_errors, f"replica-{i}") for i, url in enumerate(urls)]
+        self.max_lag_seconds = max_lag_seconds
+        self.health_check_seconds = health_check_seconds
+        self._next = 0
+        # keys of rows this worker wrote within the lag window, a replica may not have them yet
+        self._written: TtlLruCache[str, bool] = TtlLruCache(max_entries=10_000)
+        self.primary_reads = 0 # lookups that ran on the primary because no replica was healthy
+        self.fallbacks = 0     # a replica read failed or missed a recent row and was repeated on the primary
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    @property
+    def lag_window_seconds(self) -> float:
+        # how far behind a replica in rotation can be: the lag allowed plus the time until a check notices more
+        return self.max_lag_seconds + self.health_check_seconds
+
+    def mark_written(self, key: str) -> None:
+        if self.replicas:
+            self._written.set(key, True, time.time() + self.lag_window_seconds)
+
+    def recently_written(self, key: str) -> bool:
+        return self._written.get(key) is not None
+
+    def pick(self) -> Replica | None:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        replica = healthy[self._next % len(healthy)]
+        self._next += 1
+        return replica
+
+    async def _measure_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            return float(await conn.scalar(_REPLICA_LAG_SQL))
+
+    async def _check(self, replica: Replica) -> None:
+        try:
+            lag = await asyncio.wait_for(self._measure_lag(replica), timeout=self.health_check_seconds)
+        except Exception as e:
+            replica.lag_seconds = None
+            replica.last_error = str(e)
+            if replica.healthy:
+                logger.warning("Replica %s out of rotation, health check failed: %s", replica.name, e)
+            replica.healthy = False
+            return
+
+        replica.lag_seconds = lag
+        replica.errors_since_check = 0
+        healthy = lag <= self.max_lag_seconds
+        if healthy != replica.healthy:
+            if healthy:
+                logger.info("Replica %s in rotation (lag %.3fs)", replica.name, lag)
+            else:
+                logger.warning("Replica %s out of rotation, lag %.3fs is over %.3fs", replica.name, lag, self.max_lag_seconds)
+        replica.healthy = healthy
+
+    async def check(self) -> None:
+        await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+
+    async def run_health_check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_seconds)
+            await self.check()
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            if "engine" in replica.__dict__: # only the ones that were used
+                await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag_seconds": replica.lag_seconds,
+                    "reads": replica.reads,
+                    "errors": replica.errors,
+                    "last_error": replica.last_error,
+                    "pool": get_pool_stats(replica.engine) if "engine" in replica.__dict__ else None,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+@lru_cache() # one set of replica pools per worker process
+def get_replica_set() -> ReplicaSet:
+    config = get_config()
+    return ReplicaSet(
+        urls=config.DATABASE_REPLICA_URLS,
+        max_lag_seconds=config.DB_REPLICA_MAX_LAG_SECONDS,
+        max_errors=config.DB_REPLICA_MAX_ERRORS,
+        health_check_seconds=config.DB_REPLICA_HEALTH_CHECK_SECONDS
+    )
+
+
+async def dispose_engine() -> None:
+    # shutdown, closes every pooled connection (a later checkout would open new ones)
+    if get_engine.cache_info().currsize:
+        await get_engine().dispose()
+    if get_replica_set.cache_info().currsize:
+        await get_replica_set().dispose()
 
 
 # async def get_session() -> AsyncGenerator[AsyncSession, None]:
@@ -22,11 +299,143 @@ AsyncSessionLocal = async_sessionmaker(
 
 
 async def get_transaction_session() -> AsyncGenerator[AsyncSession, None]:
-    async with AsyncSession(engine) as session:
-        async with session.begin():  # Auto transaction per request
-            try:
-                yield session
-            except:
-                await session.rollback()
-                raise
-            # Auto-commits on exit
+    # one session per request, fastapi caches it so every dependency gets the same one
+    # nothing is taken from the pool until the first statement runs (i.e. logout without a cookie never does)
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit() # no-op if nothing ran
+        except:
+            await session.rollback()
+            raise
+
+
+# use this instead of Depends(get_transaction_session)
+# scope="function" commits and gives the connection back as soon as the handler returns,
+# before the response is serialized and sent
+TransactionSession = Annotated[AsyncSession, Depends(get_transaction_session, scope="function")]
+
+
+class ReadRouter:
+    """
+    The read only lookups of one request, on a healthy replica when there is one.
+    The replica is picked when the first lookup runs (a request answered from a cache never
+    picks one), later lookups of the request reuse its session. Without a healthy replica
+    lookups run on the request's transaction session, so no second connection is taken.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._picked = False
+        self._replica: Replica | None = None
+        self._replica_session: AsyncSession | None = None
+
+    def _pick(self) -> None:
+        self._picked = True
+        self._replica = get_replica_set().pick()
+        if self._replica is not None:
+            self._replica_session = self._replica.sessionmaker()
+
+    async def read(
+            self,
+            lookup: Callable[[AsyncSession], Awaitable[Result[T | None, Exception]]],
+            on_primary: bool = False,
+            retry_missing: bool = False
+        ) -> Result[T | None, Exception]:
+        # on_primary for rows a replica may have an old version of (i.e. just invalidated)
+        # retry_missing for rows it may not have at all yet (i.e. a user who signed up a moment ago),
+        # only then is a miss asked again on the primary, an unknown email or a rotated authid is
+        # answered by the replica alone. A failed replica lookup is always repeated on the primary
+        replica_set = get_replica_set()
+        if on_primary or not replica_set.enabled:
+            return await lookup(self.session)
+
+        if not self._picked:
+            self._pick()
+        if self._replica is None:
+            replica_set.primary_reads += 1
+            return await lookup(self.session)
+
+        try:
+            result = await lookup(self._replica_session)
+        except Exception as e:
+            # errors while connecting (i.e. OSError) are not wrapped in SQLAlchemyError, so the lookup raises them
+            self._replica.record_error(e)
+            result = Error(e)
+        self._replica.reads += 1
+        if isinstance(result, Error) or (retry_missing and result.data is None):
+            replica_set.fallbacks += 1
+            result = await lookup(self.session)
+        return result
+
+    async def close(self) -> None:
+        # nothing to commit, closing rolls the read back
+        if self._replica_session is not None:
+            await self._replica_session.close()
+
+
+async def get_read_router(session: TransactionSession) -> AsyncGenerator[ReadRouter, None]:
+    reads = ReadRouter(session)
+    try:
+        yield reads
+    finally:
+        await reads.close()
+
+
+# for handlers/dependencies that read, writes still go through TransactionSession
+Reads = Annotated[ReadRouter, Depends(get_read_router, scope="function")]
+
+
+async def warmup_pool(engine: AsyncEngine, connections: int, warm_up: Callable[[AsyncSession], Awaitable[None]] | None = None) -> int:
+    # open and validate connections up front so the first requests don't pay for connecting
+    # warm_up runs on every one of them (i.e. the hot queries, see main.py) and is rolled back
+    async def _open() -> AsyncConnection:
+        conn = await engine.connect()
+        await conn.execute(text("SELECT 1"))
+        if warm_up is not None:
+            async with AsyncSession(bind=conn) as session:
+                await warm_up(session)
+            await conn.rollback()
+        return conn
+
+    results = await asyncio.gather(*(_open() for _ in range(connections)), return_exceptions=True)
+    opened = 0
+    for result in results:
+        if isinstance(result, AsyncConnection):
+            opened += 1
+            await result.close() # back to the pool, still connected
+        else:
+            logger.warning("Unable to warm up pool connection: %s", result)
+    return opened
+
+
+def get_pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "in_use": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+        "max_overflow": get_config().DB_MAX_OVERFLOW,
+        "name": pool.metrics.pool_label,
+        "checkouts": pool.metrics.checkouts,
+        "timeouts": pool.metrics.timeouts,
+        "checkout_wait_seconds_total": round(pool.metrics.wait_seconds_total, 6),
+        "checkout_wait_seconds_max": round(pool.metrics.wait_seconds_max, 6),
+    }
+
+
+def run_after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    # for in-process side effects (i.e. caches) that must not happen if the transaction rolls back
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session: Session) -> None:
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_after_commit_callbacks(session: Session) -> None:
+    session.info.pop("after_commit", None)
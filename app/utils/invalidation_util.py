@@ -0,0 +1,202 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+import asyncpg
+from sqlalchemy.engine import make_url
+from app.config import get_config
+from app.utils.revocation_cache_util import get_revocation_cache
+from app.utils.principal_cache_util import get_principal_cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+# postgres rejects notify payloads of 8000 bytes or more, events are batched below that
+_MAX_PAYLOAD_BYTES = 7900
+
+
+class InvalidationBus:
+    """
+    Keeps the in-process caches of every worker in step over Postgres LISTEN/NOTIFY.
+
+    Events are one line each, several per notification, every one ends with the time it was sent:
+        r <revocation key> <expiry epoch>   token revoked (RevokedTokenModel.revoke)
+        p <authid value>                    principal changed (UserModel.update_status, AuthidModel.rotate)
+    Writers apply their own events locally after commit and hand them to the bus, which sends
+    them from its own connection, which also listens (not a pooled one, LISTEN needs the session
+    to itself, so it can not go through pgbouncer in transaction pooling mode either).
+    After the connection drops, events may have been missed: on reconnect the principal cache
+    is cleared and the revocation cache rebuilt. Unsent events are kept and sent after reconnecting.
+    """
+
+    def __init__(self, enabled: bool, dsn: str, keepalive_seconds: float, max_backoff_seconds: float, max_pending: int):
+        self.enabled = enabled
+        self.dsn = dsn
+        self.keepalive_seconds = keepalive_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._outbox: deque[str] = deque(maxlen=max_pending) # oldest events are dropped when full
+        self._wakeup = asyncio.Event()
+        self._conn: asyncpg.Connection | None = None
+        self._server_pid: int | None = None
+        self._started = False # nothing is queued in processes that never run the bus (i.e. the cli)
+
+        self.published = 0
+        self.received = 0
+        self.dropped = 0   # outbox overflow, other workers only see those after their ttl/rebuild
+        self.reconnects = 0
+        self.resyncs = 0
+        self.last_latency_ms: float | None = None # commit of the writer to applied here, roughly
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    def revoked(self, key: str, ttl: datetime) -> None:
+        self._publish(f"r {key} {int(ttl.timestamp())}")
+
+    def principal_changed(self, authid_value: str) -> None:
+        self._publish(f"p {authid_value}")
+
+    def _publish(self, event: str) -> None:
+        # called from after commit callbacks, never blocks or raises
+        if not self.enabled or not self._started:
+            return
+        if len(self._outbox) == self._outbox.maxlen:
+            self.dropped += 1
+        self._outbox.append(f"{event} {time.time():.3f}")
+        self._wakeup.set()
+
+    def _apply(self, event: str) -> None:
+        kind, *fields = event.split(" ")
+        if kind == "r":
+            key, expires_at, sent_at = fields
+            get_revocation_cache().add(key, datetime.fromtimestamp(int(expires_at), tz=timezone.utc))
+        elif kind == "p":
+            authid_value, sent_at = fields
+            get_principal_cache().invalidate(authid_value)
+        else:
+            logger.warning("Unknown invalidation event %r", event)
+            return
+        self.last_latency_ms = max(0.0, (time.time() - float(sent_at)) * 1000)
+
+    def _on_notification(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        # this worker applied its own events already
+        if pid == self._server_pid:
+            return
+        for event in payload.split("\n"):
+            self.received += 1
+            try:
+                self._apply(event)
+            except ValueError:
+                logger.warning("Malformed invalidation event %r", event)
+
+    def _on_termination(self, conn: asyncpg.Connection) -> None:
+        self._wakeup.set() # the send loop notices the closed connection
+
+    async def connect(self) -> None:
+        self._started = True
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await conn.add_listener(CHANNEL, self._on_notification)
+            conn.add_termination_listener(self._on_termination)
+        except BaseException:
+            await conn.close()
+            raise
+        self._server_pid = conn.get_server_pid()
+        self._conn = conn
+
+    async def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await asyncio.wait_for(conn.close(), timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _resync(self) -> None:
+        # whatever was published while disconnected is lost, start over from the database
+        self.resyncs += 1
+        get_principal_cache().clear()
+        await get_revocation_cache().rebuild_from_db()
+
+    def _next_batch(self) -> list[str]:
+        batch, size = [], 0
+        while self._outbox and size + len(self._outbox[0]) + 1 <= _MAX_PAYLOAD_BYTES:
+            event = self._outbox.popleft()
+            batch.append(event)
+            size += len(event) + 1
+        return batch
+
+    async def _send_loop(self) -> None:
+        # returns (or raises) once the connection is gone
+        while self.connected:
+            if not self._outbox:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    # a half open connection only shows up when something is sent
+                    await self._conn.execute("SELECT 1")
+                continue
+
+            batch = self._next_batch()
+            try:
+                await self._conn.execute("SELECT pg_notify($1, $2)", CHANNEL, "\n".join(batch))
+            except BaseException:
+                self._outbox.extendleft(reversed(batch)) # resent after reconnecting
+                raise
+            self.published += len(batch)
+
+    async def run_forever(self) -> None:
+        # main.py connects before the revocation cache is first built, so nothing falls in between
+        backoff = 0.5
+        while True:
+            try:
+                if not self.connected:
+                    await self.connect()
+                    self.reconnects += 1
+                    logger.info("Invalidation bus reconnected, resyncing caches")
+                    await self._resync()
+                backoff = 0.5
+                await self._send_loop()
+                logger.warning("Invalidation bus connection closed")
+            except asyncio.CancelledError:
+                await self.close()
+                raise
+            except Exception as e:
+                logger.warning("Invalidation bus connection failed: %s, retrying in %.1fs", e, backoff)
+            await self.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "published": self.published,
+            "received": self.received,
+            "pending": len(self._outbox),
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "resyncs": self.resyncs,
+            "last_latency_ms": round(self.last_latency_ms, 3) if self.last_latency_ms is not None else None,
+        }
+
+
+def _listen_dsn(url: str) -> str:
+    # asyncpg wants a plain postgresql:// url, the sqlalchemy one names the driver
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+@lru_cache() # one bus (one listening connection) per worker process
+def get_invalidation_bus() -> InvalidationBus:
+    config = get_config()
+    return InvalidationBus(
+        enabled=config.INVALIDATION_BUS_ENABLED,
+        dsn=_listen_dsn(config.INVALIDATION_BUS_DATABASE_URL or config.DATABASE_URL),
+        keepalive_seconds=config.INVALIDATION_BUS_KEEPALIVE_SECONDS,
+        max_backoff_seconds=config.INVALIDATION_BUS_MAX_BACKOFF_SECONDS,
+        max_pending=config.INVALIDATION_BUS_MAX_PENDING
+    )
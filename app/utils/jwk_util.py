@@ -0,0 +1,196 @@
+import json
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import Any
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+from jwt.algorithms import RSAAlgorithm, ECAlgorithm, OKPAlgorithm
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_config
+from app.utils.db_util import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+
+def _generate_private_key(algorithm: str) -> Any:
+    match algorithm:
+        case "RS256":
+            return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        case "ES256":
+            return ec.generate_private_key(ec.SECP256R1())
+        case "EdDSA":
+            return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported signing algorithm {algorithm}")
+
+
+def _public_jwk(algorithm: str, kid: str, public_key: Any) -> dict:
+    match algorithm:
+        case "RS256":
+            jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+        case "ES256":
+            jwk = ECAlgorithm.to_jwk(public_key, as_dict=True)
+        case "EdDSA":
+            jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+        case _:
+            raise ValueError(f"Unsupported signing algorithm {algorithm}")
+    return {**jwk, "kid": kid, "alg": algorithm, "use": "sig"}
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    kid: str
+    algorithm: str
+    private_key: Any
+    public_key: Any
+    public_jwk: dict
+    datetime_activated: datetime
+    datetime_expires: datetime
+    datetime_ttl: datetime
+
+
+class KeyRing:
+    """
+    Asymmetric access token keys, shared by every worker through signing_key_model.
+
+    Signing uses the newest activated key of the configured algorithm, verification is a
+    dict lookup on the token's kid header. A replacement key is created publish_ahead
+    before the current one expires and only starts signing once every worker reloaded it
+    and every cached copy of the jwks has expired, so verifiers always know the kid.
+    """
+
+    def __init__(self, algorithm: str, rotation_days: int, publish_ahead_seconds: int, token_lifetime_seconds: int, secret: str):
+        self.algorithm = algorithm
+        self.rotation = timedelta(days=rotation_days)
+        self.publish_ahead = timedelta(seconds=publish_ahead_seconds)
+        self.token_lifetime = timedelta(seconds=token_lifetime_seconds)
+        self._password = secret.encode()
+        self._keys: dict[str, SigningKey] = {}
+        self.version = 0 # bumped whenever a key is added or removed
+
+    def get_signing_key(self) -> SigningKey | None:
+        # keeps signing with the old key past its expiry until the replacement activates, so there is never a gap
+        now = datetime.now(timezone.utc)
+        candidates = [
+            key for key in self._keys.values()
+            if key.algorithm == self.algorithm and key.datetime_activated <= now < key.datetime_ttl
+        ]
+        return max(candidates, key=lambda key: key.datetime_activated, default=None)
+
+    def get_verification_key(self, kid: str) -> SigningKey | None:
+        key = self._keys.get(kid)
+        if key is None or key.datetime_ttl <= datetime.now(timezone.utc):
+            return None
+        return key
+
+    def jwks(self) -> dict:
+        now = datetime.now(timezone.utc)
+        return {"keys": [key.public_jwk for key in self._keys.values() if key.datetime_ttl > now]}
+
+    def _needs_new_key(self, models: list, now: datetime) -> bool:
+        own = [model for model in models if model.algorithm == self.algorithm]
+        if any(model.datetime_activated > now for model in own):
+            return False # a replacement is already published and waiting
+        newest_expiry = max((model.datetime_expires for model in own), default=None)
+        return newest_expiry is None or newest_expiry - now <= self.publish_ahead
+
+    def _new_key_model(self, now: datetime, has_active_key: bool):
+        from app.models.signing_key import SigningKeyModel # avoid circular import
+
+        kid = uuid.uuid4().hex
+        private_key = _generate_private_key(self.algorithm)
+        # nothing to publish ahead for when there is no key to sign with yet
+        activated = now + self.publish_ahead if has_active_key else now
+        expires = activated + self.rotation
+        return SigningKeyModel(
+            kid=kid,
+            algorithm=self.algorithm,
+            private_key=private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.BestAvailableEncryption(self._password)
+            ).decode(),
+            public_jwk=json.dumps(_public_jwk(self.algorithm, kid, private_key.public_key())),
+            datetime_activated=activated,
+            datetime_expires=expires,
+            # may keep signing up to publish_ahead past expiry, and its tokens live token_lifetime after that
+            datetime_ttl=expires + self.publish_ahead + self.token_lifetime
+        )
+
+    def _load(self, models: list) -> None:
+        keys: dict[str, SigningKey] = {}
+        for model in models:
+            existing = self._keys.get(model.kid)
+            if existing is not None:
+                keys[model.kid] = existing # decrypting is not free, reuse
+                continue
+
+            private_key = serialization.load_pem_private_key(model.private_key.encode(), password=self._password)
+            keys[model.kid] = SigningKey(
+                kid=model.kid,
+                algorithm=model.algorithm,
+                private_key=private_key,
+                public_key=private_key.public_key(),
+                public_jwk=json.loads(model.public_jwk),
+                datetime_activated=model.datetime_activated,
+                datetime_expires=model.datetime_expires,
+                datetime_ttl=model.datetime_ttl
+            )
+
+        if keys.keys() != self._keys.keys():
+            self.version += 1
+        self._keys = keys
+
+    async def rotate_and_load(self, session: AsyncSession) -> None:
+        from app.models.signing_key import SigningKeyModel # avoid circular import
+
+        now = datetime.now(timezone.utc)
+        models = (await SigningKeyModel.get_all_unexpired(session, now)).unwrap_or_raise()
+
+        if self._needs_new_key(models, now):
+            # check again under the lock, another worker may have just created it
+            (await SigningKeyModel.lock_for_rotation(session)).unwrap_or_raise()
+            models = (await SigningKeyModel.get_all_unexpired(session, now)).unwrap_or_raise()
+            if self._needs_new_key(models, now):
+                has_active_key = any(
+                    model.algorithm == self.algorithm and model.datetime_activated <= now
+                    for model in models
+                )
+                new_model = self._new_key_model(now, has_active_key)
+                session.add(new_model)
+                await session.flush()
+                models.append(new_model)
+                logger.info("Created signing key %s (%s), signs from %s", new_model.kid, new_model.algorithm, new_model.datetime_activated)
+
+        self._load(models)
+
+    async def refresh_from_db(self) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    await self.rotate_and_load(session)
+        except Exception:
+            logger.exception("Unable to refresh signing keys")
+
+    async def run_refresh_loop(self, interval_seconds: float) -> None:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self.refresh_from_db()
+
+
+@lru_cache() # one key ring per worker process
+def get_keyring() -> KeyRing:
+    config = get_config()
+    return KeyRing(
+        algorithm=config.JWT_ACCESS_ALGORITHM or "",
+        rotation_days=config.JWT_KEY_ROTATION_DAYS,
+        # every worker reloads and every cached jwks expires before a new key signs anything
+        publish_ahead_seconds=2 * config.JWKS_MAX_AGE_SECONDS + config.JWT_KEY_REFRESH_SECONDS,
+        token_lifetime_seconds=config.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        secret=config.SECRET_KEY
+    )
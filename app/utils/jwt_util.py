@@ -1,8 +1,15 @@
 import jwt
+import uuid
+import hashlib
 import datetime
 from enum import Enum
+from typing import Any
 from app.config import get_config
+from app.constants import REVOKED_TOKEN_KEY_LENGTH
 from app.utils.result_util import Result, Ok, Error
+from app.utils.jwk_util import get_keyring
+from app.utils.token_cache_util import get_verified_token_cache
+from app.utils.metrics_util import count_jwt
 
 class JwtType(Enum):
     ACCESS = "access"
@@ -10,47 +17,68 @@ class JwtType(Enum):
 
 class JwtUtil:
 
-    def _generate_token(self, key: str, sub: str, exp: datetime.datetime, token_type: JwtType) -> Result[str, Exception]:
+    # key is a secret for HS* algorithms or a private/public key object for asymmetric ones
+    # algorithm defaults to Config.ALGORITHM
+    def _generate_token(self, key: Any, sub: str, exp: datetime.datetime, token_type: JwtType, algorithm: str | None = None, headers: dict | None = None) -> Result[str, Exception]:
         try:
             payload = {
                 "sub": sub,
                 "iat": int(datetime.datetime.now(datetime.timezone.utc).timestamp()),
                 "exp": int(exp.timestamp()),
+                "jti": uuid.uuid4().hex,
                 "token_type": token_type.value
             }
 
-            token = jwt.encode(payload=payload, algorithm=get_config().ALGORITHM, key=key)
+            token = jwt.encode(payload=payload, algorithm=algorithm or get_config().ALGORITHM, key=key, headers=headers)
+            count_jwt("encode", token_type.value, "ok")
             return Ok(token)
         except Exception as e:
+            count_jwt("encode", token_type.value, "error")
             return Error(e)
         
-    def _decode_token(self, key: str, token: str, token_type: JwtType) -> Result[dict, Exception]:
+    def _decode_token(self, key: Any, token: str, token_type: JwtType, algorithm: str | None = None) -> Result[dict, Exception]:
         try:
             payload = jwt.decode(
                 token,
                 key=key,
-                algorithms=[get_config().ALGORITHM],
+                algorithms=[algorithm or get_config().ALGORITHM],
                 options={"verify_exp": True},  # ensure `exp` is checked
             )
 
             if payload["token_type"] != token_type.value:
-                raise ValueError(f"Expected {token_type.value}, got {payload["token_type"]}")
+                raise ValueError(f"Expected {token_type.value}, got {payload['token_type']}")
             
+            count_jwt("decode", token_type.value, "ok")
             return Ok(payload)
         except Exception as e:
+            count_jwt("decode", token_type.value, "error")
             return Error(e)
     
     def generate_access_token(self, authid_value: str) -> Result[str, Exception]:
         try:
-            secret = get_config().JWT_ACCESS_SECRET
             exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=get_config().ACCESS_TOKEN_EXPIRE_MINUTES)
             token_type = JwtType.ACCESS
 
+            if get_config().JWT_ACCESS_ALGORITHM is None:
+                token = self._generate_token(
+                    key=get_config().JWT_ACCESS_SECRET,
+                    sub=authid_value,
+                    exp=exp,
+                    token_type=token_type
+                ).unwrap_or_raise()
+                return Ok(token)
+
+            signing_key = get_keyring().get_signing_key()
+            if signing_key is None:
+                raise ValueError("No active signing key")
+
             token = self._generate_token(
-                key=secret,
+                key=signing_key.private_key,
                 sub=authid_value,
                 exp=exp,
-                token_type=token_type
+                token_type=token_type,
+                algorithm=signing_key.algorithm,
+                headers={"kid": signing_key.kid}
             ).unwrap_or_raise()
             return Ok(token)
         except Exception as e:
@@ -73,11 +101,41 @@ class JwtUtil:
     
 
     def decode_access_token(self, token: str) -> Result[dict, Exception]:
+        # same token on every request until it expires, verify it once
+        token_cache = get_verified_token_cache()
+        key_version = get_keyring().version
+        cached = token_cache.get(token, key_version)
+        if cached is not None:
+            count_jwt("decode", JwtType.ACCESS.value, "cached")
+            return cached
+
+        result = self._verify_access_token(token)
+        if isinstance(result, Ok):
+            token_cache.set(token, result, key_version)
+        return result
+
+    def _verify_access_token(self, token: str) -> Result[dict, Exception]:
         try:
+            # tokens without a kid are symmetric ones, either because no JWT_ACCESS_ALGORITHM is set
+            # or because they were issued before it was (they are short lived)
+            kid = jwt.get_unverified_header(token).get("kid") if get_config().JWT_ACCESS_ALGORITHM else None
+            if kid is None:
+                payload = self._decode_token(
+                    key=get_config().JWT_ACCESS_SECRET,
+                    token=token,
+                    token_type=JwtType.ACCESS
+                ).unwrap_or_raise()
+                return Ok(payload)
+
+            verification_key = get_keyring().get_verification_key(kid)
+            if verification_key is None:
+                raise ValueError(f"Unknown signing key {kid}")
+
             payload = self._decode_token(
-                key=get_config().JWT_ACCESS_SECRET,
+                key=verification_key.public_key,
                 token=token,
-                token_type=JwtType.ACCESS
+                token_type=JwtType.ACCESS,
+                algorithm=verification_key.algorithm
             ).unwrap_or_raise()
 
             return Ok(payload)
@@ -95,4 +153,13 @@ class JwtUtil:
 
             return Ok(payload)
         except Exception as e:
-            return Error(e)
\ No newline at end of file
+            return Error(e)
+    
+
+    def get_revocation_key(self, token: str, payload: dict) -> str:
+        # revocations are stored under the jti instead of the whole token
+        # tokens issued before jti was added fall back to a digest of the token
+        jti = payload.get("jti")
+        if jti is not None:
+            return jti
+        return hashlib.sha256(token.encode()).hexdigest()[:REVOKED_TOKEN_KEY_LENGTH]
@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+import contextvars
+from dataclasses import dataclass
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess
+
+# with PROMETHEUS_MULTIPROC_DIR set (entrypoint.sh does) every worker writes its samples there
+# and a scrape of any one worker returns the sum over all of them
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ["method", "route", "status"]
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time spent in sql statements per request",
+    ["method", "route"]
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "Sql statements per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "Cpu time of one bcrypt call, without the pool queue",
+    ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+)
+PASSWORD_HASH_QUEUE_DURATION = Histogram(
+    "password_hash_queue_duration_seconds", "Time a bcrypt call waited for a pool worker",
+    ["operation"]
+)
+JWT_OPERATIONS = Counter(
+    "jwt_operations_total", "Jwt encodes and decodes",
+    ["operation", "token_type", "result"] # result: ok, error, cached
+)
+# pool: primary, replica-0, replica-1, ... (the position in DATABASE_REPLICA_URLS)
+DB_POOL_IN_USE = Gauge("db_pool_connections_in_use", "Connections checked out of the pool", ["pool"], multiprocess_mode="livesum")
+DB_POOL_OPEN = Gauge("db_pool_connections_open", "Connections the pool holds open", ["pool"], multiprocess_mode="livesum")
+DB_POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time waited for a pool connection", ["pool"])
+DB_POOL_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Checkouts that gave up waiting", ["pool"])
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_seconds: float = 0.0
+
+
+# set per request by MetricsMiddleware, the engine events add to whatever the current request set
+_request_stats: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine: AsyncEngine, pool_label: str) -> None:
+    sync_engine = engine.sync_engine
+    pool_open = DB_POOL_OPEN.labels(pool=pool_label)
+    pool_in_use = DB_POOL_IN_USE.labels(pool=pool_label)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        started = exception_context.connection.info.get("statement_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+    @event.listens_for(sync_engine.pool, "connect")
+    def _connect(dbapi_connection, connection_record):
+        pool_open.inc()
+
+    @event.listens_for(sync_engine.pool, "close")
+    def _close(dbapi_connection, connection_record):
+        pool_open.dec()
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_in_use.inc()
+
+    @event.listens_for(sync_engine.pool, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        pool_in_use.dec()
+
+
+class MetricsMiddleware:
+    # plain asgi middleware, BaseHTTPMiddleware would add a task and a stream per request
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500 # if the app raises before starting a response
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+
+            # the route template, not the path, keeps label cardinality bounded
+            route = scope.get("route")
+            route_label = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_DURATION.labels(method, route_label, str(status_code)).observe(elapsed)
+            REQUEST_DB_DURATION.labels(method, route_label).observe(stats.db_seconds)
+            REQUEST_DB_STATEMENTS.labels(method, route_label).observe(stats.statements)
+
+
+def count_jwt(operation: str, token_type: str, result: str) -> None:
+    JWT_OPERATIONS.labels(operation, token_type, result).inc()
+
+
+def observe_password_hash(operation: str, compute_seconds: float, total_seconds: float) -> None:
+    PASSWORD_HASH_DURATION.labels(operation).observe(compute_seconds)
+    PASSWORD_HASH_QUEUE_DURATION.labels(operation).observe(max(0.0, total_seconds - compute_seconds))
+
+
+async def run_loop_lag_monitor(interval_seconds: float) -> None:
+    # a blocked loop (sync bcrypt, big json) shows up as wakeups arriving late
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval_seconds
+        await asyncio.sleep(interval_seconds)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+def render_latest() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead() -> None:
+    # drops this worker's live gauges from the aggregate
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
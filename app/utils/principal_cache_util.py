@@ -0,0 +1,126 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, TypeVar
+from app.config import get_config
+from app.utils.cache_util import TtlLruCache, SingleFlight
+
+T = TypeVar("T")
+
+# how long an invalidation is remembered for lookups that started before it, longer than any lookup takes
+_GENERATION_TTL_SECONDS = 300
+
+
+@dataclass(frozen=True)
+class Principal:
+    # what protected routes need from the user, detached from any db session
+    id: int
+    authid_value: str
+    firstname: str
+    lastname: str
+    pid: str
+    email: str
+    datetime_deactivated: datetime | None
+    datetime_deleted: datetime | None
+
+    @property
+    def is_active(self) -> bool:
+        return not (self.datetime_deactivated or self.datetime_deleted)
+
+
+class PrincipalCache:
+    """
+    Resolved principals keyed by authid value, kept for at most ttl_seconds (the staleness window).
+    Anything that changes a user's status must call invalidate(), see UserModel.update_status.
+    Invalidated authids are remembered for invalidated_ttl_seconds (how far behind a read replica
+    may be), their lookups go to the primary until then so a replica can not bring the old status back.
+    Concurrent misses for one authid share a single lookup (coalesce()). Take generation() before
+    the lookup and hand it to set(), a lookup that raced an invalidate() is then not cached.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: float, max_entries: int, invalidated_ttl_seconds: float = 0):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.invalidated_ttl_seconds = invalidated_ttl_seconds
+        self._principals: TtlLruCache[str, Principal] = TtlLruCache(max_entries=max_entries)
+        self._invalidated: TtlLruCache[str, bool] = TtlLruCache(max_entries=max_entries)
+        self._lookups: SingleFlight[str, object] = SingleFlight()
+        self._generations: TtlLruCache[str, int] = TtlLruCache(max_entries=max_entries)
+        self._clears = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, authid_value: str) -> Principal | None:
+        if not self.enabled:
+            return None
+
+        principal = self._principals.get(authid_value)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def generation(self, authid_value: str) -> tuple[int, int]:
+        return self._clears, self._generations.get(authid_value, 0)
+
+    def set(self, principal: Principal, generation: tuple[int, int]) -> None:
+        if not self.enabled:
+            return
+        # invalidated while the lookup ran, what it read may be the old status
+        if self.generation(principal.authid_value) != generation:
+            self.stale_sets += 1
+            return
+        self._principals.set(principal.authid_value, principal, time.time() + self.ttl_seconds)
+
+    async def coalesce(self, authid_value: str, lookup: Callable[[], Awaitable[T]]) -> T:
+        # the parallel requests of a page load all miss at once, only the first one queries
+        # and the others get its result, works with the cache disabled too
+        return await self._lookups.do(authid_value, lookup)
+
+    def invalidate(self, authid_value: str) -> None:
+        self.invalidations += 1
+        self._principals.pop(authid_value)
+        self._generations.set(authid_value, self._generations.get(authid_value, 0) + 1, time.time() + _GENERATION_TTL_SECONDS)
+        self._lookups.forget(authid_value) # a lookup in flight may have read the old status
+        if self.invalidated_ttl_seconds > 0:
+            self._invalidated.set(authid_value, True, time.time() + self.invalidated_ttl_seconds)
+
+    def recently_invalidated(self, authid_value: str) -> bool:
+        return self._invalidated.get(authid_value) is not None
+
+    def clear(self) -> None:
+        self._clears += 1
+        self._principals.clear()
+        self._lookups.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "entries": len(self._principals),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "stale_sets": self.stale_sets,
+            "lookups": self._lookups.calls,
+            "coalesced_lookups": self._lookups.coalesced,
+            "lookups_in_flight": len(self._lookups),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache() # one cache per worker process
+def get_principal_cache() -> PrincipalCache:
+    config = get_config()
+    return PrincipalCache(
+        enabled=config.PRINCIPAL_CACHE_ENABLED,
+        ttl_seconds=config.PRINCIPAL_CACHE_TTL_SECONDS,
+        max_entries=config.PRINCIPAL_CACHE_MAX_ENTRIES,
+        # the lag a replica may have plus how long it can take for a check to notice more than that
+        invalidated_ttl_seconds=config.DB_REPLICA_MAX_LAG_SECONDS + config.DB_REPLICA_HEALTH_CHECK_SECONDS if config.DATABASE_REPLICA_URLS else 0
+    )
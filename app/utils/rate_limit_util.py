@@ -0,0 +1,278 @@
+import math
+import time
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+from app.config import get_config
+from app.utils.cache_util import TtlLruCache
+from app.utils.db_util import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend(ABC):
+    """
+    Where bucket and failure state lives. Every method gets the whole policy so backends stay stateless about it.
+    take() returns 0.0 when a token was taken, otherwise the seconds until the key may try again
+    (an empty bucket or an active backoff block, whichever is longer).
+    """
+
+    @abstractmethod
+    async def take(self, key: str, capacity: float, refill_per_second: float, ttl_seconds: float) -> float:
+        ...
+
+    @abstractmethod
+    async def record_failure(self, key: str, free_failures: int, base_seconds: float, max_seconds: float, reset_seconds: float) -> float:
+        ...
+
+    @abstractmethod
+    async def reset_failures(self, key: str) -> None:
+        ...
+
+
+@dataclass
+class _KeyState:
+    tokens: float
+    updated: float
+    failures: int = 0
+    failure_at: float = 0.0
+    blocked_until: float = 0.0
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    # per worker process, with N workers an attacker gets N times the budget
+    # bounded so spoofed/rotating ips can not grow it without limit
+
+    def __init__(self, max_entries: int):
+        self._states: TtlLruCache[str, _KeyState] = TtlLruCache(max_entries=max_entries)
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, ttl_seconds: float) -> float:
+        now = time.time()
+        state = self._states.get(key)
+        if state is None:
+            state = _KeyState(tokens=capacity, updated=now)
+
+        state.tokens = min(capacity, state.tokens + (now - state.updated) * refill_per_second)
+        state.updated = now
+        wait = max(state.blocked_until - now, 0.0)
+        if wait == 0.0 and state.tokens >= 1:
+            state.tokens -= 1
+        else:
+            wait = max(wait, (1 - state.tokens) / refill_per_second)
+
+        self._states.set(key, state, max(now + ttl_seconds, state.blocked_until))
+        return wait
+
+    async def record_failure(self, key: str, free_failures: int, base_seconds: float, max_seconds: float, reset_seconds: float) -> float:
+        now = time.time()
+        state = self._states.get(key)
+        if state is None:
+            return 0.0 # take() always runs first, an evicted key starts over
+
+        state.failures = 1 if now - state.failure_at >= reset_seconds else state.failures + 1
+        state.failure_at = now
+        if state.failures > free_failures:
+            state.blocked_until = now + min(max_seconds, base_seconds * 2 ** (state.failures - free_failures - 1))
+
+        self._states.set(key, state, max(now + reset_seconds, state.blocked_until))
+        return max(state.blocked_until - now, 0.0)
+
+    async def reset_failures(self, key: str) -> None:
+        state = self._states.get(key)
+        if state is not None:
+            state.failures = 0
+            state.failure_at = 0.0
+            state.blocked_until = 0.0
+
+
+class PostgresRateLimitBackend(RateLimitBackend):
+    # shared by every worker, each call is its own short transaction so a failed
+    # login (which rolls back the request's transaction) still counts
+
+    async def _run(self, operation, *args, **kwargs):
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                return (await operation(session, *args, **kwargs)).unwrap_or_raise()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, ttl_seconds: float) -> float:
+        from app.models.rate_limit import RateLimitModel
+
+        return await self._run(
+            RateLimitModel.take,
+            key=key,
+            capacity=capacity,
+            refill_per_second=refill_per_second,
+            ttl=timedelta(seconds=ttl_seconds)
+        )
+
+    async def record_failure(self, key: str, free_failures: int, base_seconds: float, max_seconds: float, reset_seconds: float) -> float:
+        from app.models.rate_limit import RateLimitModel
+
+        return await self._run(
+            RateLimitModel.record_failure,
+            key=key,
+            free_failures=free_failures,
+            base_seconds=base_seconds,
+            max_seconds=max_seconds,
+            reset_after=timedelta(seconds=reset_seconds)
+        )
+
+    async def reset_failures(self, key: str) -> None:
+        from app.models.rate_limit import RateLimitModel
+
+        await self._run(RateLimitModel.reset_failures, key=key)
+
+
+@dataclass(frozen=True)
+class BucketPolicy:
+    capacity: float # burst
+    refill_per_minute: float
+    free_failures: int # failures allowed before backoff starts
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.refill_per_minute / 60
+
+
+class RateLimiter:
+    """
+    Token buckets per client ip and per email for each scope (login, signup), plus exponential
+    backoff once a key keeps failing. Checked before any bcrypt work is done.
+    Fails open: if the backend errors, the request goes through and backend_errors is counted.
+    """
+
+    def __init__(
+            self,
+            backend: RateLimitBackend,
+            enabled: bool,
+            ip_policy: BucketPolicy,
+            email_policy: BucketPolicy,
+            backoff_base_seconds: float,
+            backoff_max_seconds: float,
+            failure_reset_seconds: float
+        ):
+        self.backend = backend
+        self.enabled = enabled
+        self.ip_policy = ip_policy
+        self.email_policy = email_policy
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.failure_reset_seconds = failure_reset_seconds
+        self.allowed = 0
+        self.throttled: dict[str, int] = {}
+        self.failures_recorded = 0
+        self.backoffs_started = 0
+        self.backend_errors = 0
+
+    @staticmethod
+    def _key(scope: str, kind: str, identity: str) -> str:
+        # fixed length and no raw emails or ips in the backend
+        return f"{scope}:{kind}:{hashlib.blake2b(identity.encode(), digest_size=16).hexdigest()}"
+
+    def _keys(self, scope: str, ip: str | None, email: str | None) -> list[tuple[str, BucketPolicy]]:
+        keys = []
+        if ip:
+            keys.append((self._key(scope, "ip", ip), self.ip_policy))
+        if email:
+            keys.append((self._key(scope, "email", email.lower()), self.email_policy))
+        return keys
+
+    def _ttl_seconds(self, policy: BucketPolicy) -> float:
+        # state is worth keeping until the bucket is full again and old failures no longer count
+        return max(policy.capacity / policy.refill_per_second, self.failure_reset_seconds)
+
+    async def check(self, scope: str, ip: str | None, email: str | None) -> int:
+        # 0 if allowed, otherwise whole seconds for the Retry-After header
+        if not self.enabled:
+            return 0
+
+        for key, policy in self._keys(scope, ip, email):
+            try:
+                wait = await self.backend.take(key, policy.capacity, policy.refill_per_second, self._ttl_seconds(policy))
+            except Exception:
+                self.backend_errors += 1
+                logger.exception("Rate limit backend failed, allowing request")
+                continue
+
+            if wait > 0:
+                kind = key.split(":")[1]
+                self.throttled[f"{scope}_{kind}"] = self.throttled.get(f"{scope}_{kind}", 0) + 1
+                return max(1, math.ceil(wait))
+
+        self.allowed += 1
+        return 0
+
+    async def record_failure(self, scope: str, ip: str | None, email: str | None) -> None:
+        if not self.enabled:
+            return
+
+        self.failures_recorded += 1
+        for key, policy in self._keys(scope, ip, email):
+            try:
+                blocked_for = await self.backend.record_failure(
+                    key,
+                    policy.free_failures,
+                    self.backoff_base_seconds,
+                    self.backoff_max_seconds,
+                    self.failure_reset_seconds
+                )
+            except Exception:
+                self.backend_errors += 1
+                logger.exception("Rate limit backend failed, failure not recorded")
+                continue
+
+            if blocked_for > 0:
+                self.backoffs_started += 1
+
+    async def record_success(self, scope: str, email: str) -> None:
+        # only the account's failures are forgiven, the ip may still be trying other accounts
+        if not self.enabled:
+            return
+
+        try:
+            await self.backend.reset_failures(self._key(scope, "email", email.lower()))
+        except Exception:
+            self.backend_errors += 1
+            logger.exception("Rate limit backend failed, failures not reset")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "allowed": self.allowed,
+            "throttled": dict(self.throttled),
+            "throttled_total": sum(self.throttled.values()),
+            "failures_recorded": self.failures_recorded,
+            "backoffs_started": self.backoffs_started,
+            "backend_errors": self.backend_errors,
+        }
+
+
+@lru_cache() # one limiter per worker process
+def get_rate_limiter() -> RateLimiter:
+    config = get_config()
+    if config.RATE_LIMIT_BACKEND == "postgres":
+        backend = PostgresRateLimitBackend()
+    else:
+        backend = MemoryRateLimitBackend(max_entries=config.RATE_LIMIT_MEMORY_MAX_ENTRIES)
+
+    return RateLimiter(
+        backend=backend,
+        enabled=config.RATE_LIMIT_ENABLED,
+        ip_policy=BucketPolicy(
+            capacity=config.RATE_LIMIT_IP_BURST,
+            refill_per_minute=config.RATE_LIMIT_IP_PER_MINUTE,
+            free_failures=config.RATE_LIMIT_IP_FREE_FAILURES
+        ),
+        email_policy=BucketPolicy(
+            capacity=config.RATE_LIMIT_EMAIL_BURST,
+            refill_per_minute=config.RATE_LIMIT_EMAIL_PER_MINUTE,
+            free_failures=config.RATE_LIMIT_EMAIL_FREE_FAILURES
+        ),
+        backoff_base_seconds=config.RATE_LIMIT_BACKOFF_BASE_SECONDS,
+        backoff_max_seconds=config.RATE_LIMIT_BACKOFF_MAX_SECONDS,
+        failure_reset_seconds=config.RATE_LIMIT_FAILURE_RESET_SECONDS
+    )
@@ -0,0 +1,172 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_config
+from app.utils.db_util import AsyncSessionLocal
+from app.models.revoked_token import RevokedTokenModel
+from app.models.rate_limit import RateLimitModel
+from app.models.refresh_session import RefreshSessionModel
+
+logger = logging.getLogger(__name__)
+
+# only one worker/process reaps at a time, the others skip their run
+REAPER_ADVISORY_LOCK_KEY = 0x7265766F6B # "revok"
+
+
+@dataclass
+class ReapReport:
+    rows_purged: int = 0
+    batches: int = 0
+    batch_timings_ms: list[float] = field(default_factory=list)
+    partitions_created: list[str] = field(default_factory=list)
+    partitions_dropped: list[str] = field(default_factory=list)
+    partition_errors: list[str] = field(default_factory=list) # retried on the next run, the purge runs anyway
+    skipped: bool = False # another reaper held the lock
+    duration_ms: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class RevokedTokenReaper:
+    """
+    Deletes expired revoked tokens in small batches, each batch in its own short transaction
+    so no lock is held for long. When the table is partitioned by day, expired partitions
+    are dropped whole and upcoming ones are created ahead of time.
+    """
+
+    def __init__(self, batch_size: int, max_batches: int, batch_pause_seconds: float, partition_premake_days: int):
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause_seconds = batch_pause_seconds
+        self.partition_premake_days = partition_premake_days
+        self.last_report: ReapReport | None = None
+        self.total_rows_purged = 0
+        self.total_runs = 0
+
+    async def _try_lock(self, session: AsyncSession) -> bool:
+        # transaction scoped, released on commit/rollback
+        result = await session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REAPER_ADVISORY_LOCK_KEY})
+        return bool(result.scalar())
+
+    async def _partition_step(self, session: AsyncSession, report: ReapReport, step, day) -> str | None:
+        # each ddl runs in a savepoint, a failing one is rolled back alone and does not abort the transaction
+        try:
+            async with session.begin_nested():
+                return (await step(session, day)).unwrap_or_raise()
+        except SQLAlchemyError as e:
+            logger.warning("Revoked token partition %s for %s failed: %s", step.__name__, day, e)
+            report.partition_errors.append(f"{step.__name__} {day}: {e}")
+            return None
+
+    async def _maintain_partitions(self, session: AsyncSession, report: ReapReport) -> None:
+        today = datetime.now(timezone.utc).date()
+        existing_days = (await RevokedTokenModel.get_partition_days(session)).unwrap_or_raise()
+
+        # a partition covers [day, day + 1) so it is fully expired once day + 1 has passed
+        for day in existing_days:
+            if day < today:
+                if (name := await self._partition_step(session, report, RevokedTokenModel.drop_partition, day)) is not None:
+                    report.partitions_dropped.append(name)
+
+        for offset in range(self.partition_premake_days + 1):
+            day = today + timedelta(days=offset)
+            if day not in existing_days:
+                if (name := await self._partition_step(session, report, RevokedTokenModel.create_partition, day)) is not None:
+                    report.partitions_created.append(name)
+
+    async def run_once(self) -> ReapReport:
+        started = time.perf_counter()
+        report = ReapReport()
+        # the stats follow every run, skipped or failed ones included
+        try:
+            await self._run(report)
+        finally:
+            report.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.last_report = report
+            self.total_rows_purged += report.rows_purged
+            self.total_runs += 1
+
+        logger.info(
+            "Reaped %s expired rows in %s batches (%.1fms), partitions dropped: %s, created: %s, failed: %s",
+            report.rows_purged, report.batches, report.duration_ms,
+            report.partitions_dropped, report.partitions_created, len(report.partition_errors)
+        )
+        return report
+
+    async def _run(self, report: ReapReport) -> None:
+        now = datetime.now(timezone.utc)
+
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                if not await self._try_lock(session):
+                    report.skipped = True
+                    return
+
+                # partition upkeep never keeps the batches below from running
+                try:
+                    async with session.begin_nested():
+                        if (await RevokedTokenModel.is_partitioned(session)).unwrap_or_raise():
+                            await self._maintain_partitions(session, report)
+                except SQLAlchemyError as e:
+                    logger.warning("Revoked token partition maintenance failed: %s", e)
+                    report.partition_errors.append(str(e))
+
+        # rows left in unpartitioned tables (or the default partition) go in batches
+        # expired rate limit state (postgres rate limit backend) and opaque refresh sessions share the batch budget
+        for model in (RevokedTokenModel, RateLimitModel, RefreshSessionModel):
+            while report.batches < self.max_batches and not report.skipped:
+                batch_started = time.perf_counter()
+                async with AsyncSessionLocal() as session:
+                    async with session.begin():
+                        if not await self._try_lock(session):
+                            report.skipped = True
+                            break
+
+                        deleted = (await model.delete_expired(
+                            session=session,
+                            before=now,
+                            limit=self.batch_size
+                        )).unwrap_or_raise()
+
+                report.batches += 1
+                report.rows_purged += deleted
+                report.batch_timings_ms.append(round((time.perf_counter() - batch_started) * 1000, 2))
+
+                if deleted < self.batch_size:
+                    break
+
+                # let other transactions through between batches
+                await asyncio.sleep(self.batch_pause_seconds)
+
+    async def run_forever(self, interval_seconds: float) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Revoked token reaper run failed")
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "total_runs": self.total_runs,
+            "total_rows_purged": self.total_rows_purged,
+            "last_report": self.last_report.to_dict() if self.last_report is not None else None,
+        }
+
+
+@lru_cache()
+def get_reaper() -> RevokedTokenReaper:
+    config = get_config()
+    return RevokedTokenReaper(
+        batch_size=config.REAPER_BATCH_SIZE,
+        max_batches=config.REAPER_MAX_BATCHES,
+        batch_pause_seconds=config.REAPER_BATCH_PAUSE_SECONDS,
+        partition_premake_days=config.REAPER_PARTITION_PREMAKE_DAYS
+    )
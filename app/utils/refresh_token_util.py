@@ -0,0 +1,20 @@
+import hashlib
+from app.constants import OPAQUE_REFRESH_TOKEN_LENGTH
+from app.utils.result_util import Result
+from app.utils.string_util import StringUtil
+
+class RefreshTokenUtil:
+    # opaque refresh tokens (REFRESH_TOKEN_MODE=opaque), the cookie holds a random handle
+    # and refresh_session_model only ever sees its hash
+
+    def generate_opaque_token(self) -> Result[str, Exception]:
+        return StringUtil().generate_random(min_length=OPAQUE_REFRESH_TOKEN_LENGTH, max_length=OPAQUE_REFRESH_TOKEN_LENGTH)
+
+    def hash_opaque_token(self, token: str) -> str:
+        # the handle is high entropy, a plain digest is enough (no salt, no slow hash)
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def is_opaque(self, token: str) -> bool:
+        # a jwt always has two dots, the handle alphabet has none
+        # cookies of either kind are accepted whatever REFRESH_TOKEN_MODE is
+        return "." not in token
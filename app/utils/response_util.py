@@ -0,0 +1,20 @@
+from typing import Any
+from fastapi import Response
+from pydantic import BaseModel
+
+
+class SchemaJSONResponse(Response):
+    """
+    Renders a pydantic model straight to json bytes with the serializer pydantic-core compiled
+    for its class (rust, no dict in between, no json.dumps).
+    FastAPI passes a returned Response through as it is, so there is no response_model
+    validation pass either. Build the model with model_construct() from values that are
+    already known to be valid, response_model on the route still documents it.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return super().render(content)
@@ -0,0 +1,178 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from functools import lru_cache
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_config
+from app.utils.cache_util import BloomFilter, TtlLruCache
+from app.utils.db_util import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# rough size of one lru entry (32 char key, expiry, OrderedDict node)
+_LRU_ENTRY_BYTES = 200
+_MIN_BLOOM_CAPACITY = 10_000
+
+
+class RevocationCache:
+    """
+    In-process layer in front of RevokedTokenModel.
+
+    check() answers from memory when it can:
+        True  -> known revoked (lru hit)
+        False -> definitely not revoked (bloom filter miss)
+        None  -> unknown, ask the database
+    The bloom filter is only trusted after a rebuild() from the table succeeded.
+    Revocations made by other workers arrive over the invalidation bus (or with the next rebuild
+    when it is off), so write paths must still rely on the unique constraint of the table.
+    """
+
+    def __init__(self, enabled: bool, max_bytes: int, false_positive_rate: float):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.false_positive_rate = false_positive_rate
+
+        # half of the budget for each structure
+        self._bloom_max_bytes = max_bytes // 2
+        self._revoked: TtlLruCache[str, bool] = TtlLruCache(max_entries=(max_bytes // 2) // _LRU_ENTRY_BYTES)
+        self._bloom: BloomFilter | None = None
+        self._rebuilding = False
+        self._pending: list[tuple[str, float]] = []
+
+        self.bloom_hits = 0      # answered "not revoked" without the db
+        self.lru_hits = 0        # answered "revoked" without the db
+        self.misses = 0          # had to go to the db
+        self.false_positives = 0 # bloom said maybe, db said no
+
+    @property
+    def loaded(self) -> bool:
+        return self._bloom is not None
+
+    def check(self, key: str) -> bool | None:
+        if not self.enabled:
+            return None
+
+        if self._revoked.get(key):
+            self.lru_hits += 1
+            return True
+
+        if self._bloom is not None and key not in self._bloom:
+            self.bloom_hits += 1
+            return False
+
+        self.misses += 1
+        return None
+
+    def record_lookup(self, key: str, ttl: datetime | None) -> None:
+        # result of a db lookup after check() returned None
+        if not self.enabled:
+            return
+
+        if ttl is None:
+            if self._bloom is not None:
+                self.false_positives += 1
+            return
+
+        self._revoked.set(key, True, ttl.timestamp())
+
+    def add(self, key: str, ttl: datetime) -> None:
+        if not self.enabled:
+            return
+
+        expires_at = ttl.timestamp()
+        if self._rebuilding:
+            # replayed on top of the new structures once the rebuild swaps them in
+            self._pending.append((key, expires_at))
+
+        if self._bloom is not None:
+            self._bloom.add(key)
+        self._revoked.set(key, True, expires_at)
+
+    async def rebuild(self, session: AsyncSession) -> None:
+        if not self.enabled:
+            return
+
+        from app.models.revoked_token import RevokedTokenModel # avoid circular import
+
+        started = time.perf_counter()
+        self._rebuilding = True
+        self._pending = []
+        try:
+            now = datetime.now(timezone.utc)
+            active_filter = RevokedTokenModel.datetime_ttl > now
+            count = await session.scalar(select(func.count()).select_from(RevokedTokenModel).where(active_filter))
+
+            bloom = BloomFilter(
+                capacity=max(_MIN_BLOOM_CAPACITY, (count or 0) * 2), # headroom for new revocations
+                false_positive_rate=self.false_positive_rate,
+                max_bytes=self._bloom_max_bytes
+            )
+            revoked: TtlLruCache[str, bool] = TtlLruCache(max_entries=self._revoked.max_entries)
+
+            # ordered by ttl so the lru ends up holding the most recent revocations
+            stmt = (
+                select(RevokedTokenModel.value, RevokedTokenModel.datetime_ttl)
+                .where(active_filter)
+                .order_by(RevokedTokenModel.datetime_ttl)
+                .execution_options(yield_per=5000)
+            )
+            result = await session.stream(stmt)
+            async for value, ttl in result:
+                bloom.add(value)
+                revoked.set(value, True, ttl.timestamp())
+
+            for key, expires_at in self._pending:
+                bloom.add(key)
+                revoked.set(key, True, expires_at)
+
+            self._bloom = bloom
+            self._revoked = revoked
+            logger.info(
+                "Revocation cache rebuilt with %s entries in %.1fms (bloom %s bytes, %s hashes)",
+                bloom.count, (time.perf_counter() - started) * 1000, bloom.nbytes, bloom.hash_count
+            )
+        finally:
+            self._rebuilding = False
+            self._pending = []
+
+    async def rebuild_from_db(self) -> None:
+        # never fatal, without a loaded bloom filter every check just falls through to the db
+        try:
+            async with AsyncSessionLocal() as session:
+                await self.rebuild(session)
+        except Exception:
+            logger.exception("Unable to rebuild revocation cache")
+
+    async def run_rebuild_loop(self, interval_seconds: float) -> None:
+        # periodic rebuilds drop expired keys from the bloom filter and pick up other workers' revocations
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self.rebuild_from_db()
+
+    def stats(self) -> dict:
+        lookups = self.bloom_hits + self.lru_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "loaded": self.loaded,
+            "max_bytes": self.max_bytes,
+            "bloom_bytes": self._bloom.nbytes if self._bloom is not None else 0,
+            "bloom_entries": self._bloom.count if self._bloom is not None else 0,
+            "lru_entries": len(self._revoked),
+            "bloom_hits": self.bloom_hits,
+            "lru_hits": self.lru_hits,
+            "misses": self.misses,
+            "false_positives": self.false_positives,
+            "hit_rate": (self.bloom_hits + self.lru_hits) / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache() # one cache per worker process
+def get_revocation_cache() -> RevocationCache:
+    config = get_config()
+    return RevocationCache(
+        enabled=config.REVOCATION_CACHE_ENABLED,
+        max_bytes=config.REVOCATION_CACHE_MAX_BYTES,
+        false_positive_rate=config.REVOCATION_CACHE_FALSE_POSITIVE_RATE
+    )
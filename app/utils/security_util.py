@@ -1,11 +1,12 @@
+import time
 from typing import Annotated
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.utils.jwt_util import JwtUtil
-from app.utils.db_util import get_transaction_session
-from app.models.user import AuthidModel, UserModel
+from app.utils.db_util import Reads, get_replica_set
+from app.models.user import UserModel
 from app.utils.result_util import Error
+from app.utils.principal_cache_util import Principal, get_principal_cache
 
 oauth2_scheme = OAuth2PasswordBearer(
         tokenUrl="/api/auth/login",
@@ -14,51 +15,63 @@ oauth2_scheme = OAuth2PasswordBearer(
 # auto_error=False if i want to customize the response errors i.e. missing "Bearer" keyword
 # but for now, this is ok
 
+def _invalid_access_token() -> HTTPException:
+    # one answer for every bad token (expired, malformed, revoked, unknown user), clients refresh on it
+    # the decode error itself is not echoed, it is pyjwt's wording and of no use to the client
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid access token",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
 class AuthRequired:
 
     async def __call__(
             self, 
-            token: str = Depends(oauth2_scheme), 
-            session: AsyncSession = Depends(get_transaction_session)
-        ) -> UserModel:
+            token: Annotated[str, Depends(oauth2_scheme)], 
+            reads: Reads
+        ) -> Principal:
         try:
             payload = JwtUtil().decode_access_token(token=token)
             if isinstance(payload, Error):
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"{payload.error}"
-                )
+                raise _invalid_access_token()
              
             authid_value = payload.data.get("sub")
             if authid_value is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid access token"
-                )
-            
-            authid_model_result = await AuthidModel.get_by_value(session=session, value=authid_value)
-            if isinstance(authid_model_result, Error):
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Server error. Try again later"
-                )
-            
-            if authid_model_result.data is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid access token"
-                )
+                raise _invalid_access_token()
             
-            authid_model: AuthidModel = authid_model_result.data
-            user_model: UserModel = authid_model.user
+            # hot path, most requests are answered by the principal cache
+            principal_cache = get_principal_cache()
+            principal = principal_cache.get(authid_value)
+            if principal is None:
+                # a replica may not have a status change or logout-all of the last moments yet,
+                # nor the user of a token issued a moment ago (i.e. at signup, on any worker)
+                issued_recently = time.time() - payload.data.get("iat", 0) < get_replica_set().lag_window_seconds
+                generation = principal_cache.generation(authid_value)
+                principal_result = await principal_cache.coalesce(authid_value, lambda: reads.read(
+                    lambda s: UserModel.get_principal_by_authid(session=s, authid_value=authid_value),
+                    on_primary=principal_cache.recently_invalidated(authid_value),
+                    retry_missing=issued_recently
+                ))
+                if isinstance(principal_result, Error):
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail="Server error. Try again later"
+                    )
+                
+                if principal_result.data is None:
+                    raise _invalid_access_token()
+                
+                principal = principal_result.data
+                principal_cache.set(principal, generation) # deactivated/deleted ones too, they fail below
 
-            if user_model.datetime_deactivated or user_model.datetime_deleted:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid access token"
-                )
+            if not principal.is_active:
+                raise _invalid_access_token()
             
-            return user_model
+            return principal
+        except HTTPException:
+            raise
         except Exception as e:
             # anything unexpected is caught here
             raise HTTPException(
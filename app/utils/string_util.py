@@ -1,13 +1,23 @@
-import string, random
+import string, secrets
 from app.utils.result_util import Result, Error, Ok
 
+_CHARACTER_POOL = string.ascii_lowercase + string.digits
+
+# every random byte maps to one pool character
+# bytes at or above the last full multiple of the pool size are dropped so there is no modulo bias
+_MAX_UNBIASED_BYTE = 256 - (256 % len(_CHARACTER_POOL))
+_BYTE_TO_CHARACTER = bytes(ord(_CHARACTER_POOL[b % len(_CHARACTER_POOL)]) for b in range(256))
+_BIASED_BYTES = bytes(range(_MAX_UNBIASED_BYTE, 256))
+
 class StringUtil:
     
     def generate_random(self, min_length: int, max_length: int) -> Result[str, Exception]:
+        # cryptographically secure, pid/authid uniqueness relies on its entropy
         try:
-            random_length = random.randint(min_length, max_length)
-            character_pool = string.ascii_lowercase + string.digits
-            value = ''.join(random.choice(character_pool) for _ in range(random_length))
-            return Ok(value)
+            random_length = min_length + secrets.randbelow(max_length - min_length + 1)
+            value = b""
+            while len(value) < random_length:
+                value += secrets.token_bytes(random_length).translate(_BYTE_TO_CHARACTER, _BIASED_BYTES)
+            return Ok(value[:random_length].decode("ascii"))
         except Exception as e:
             return Error(e)
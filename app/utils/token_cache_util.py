@@ -0,0 +1,72 @@
+import hashlib
+from functools import lru_cache
+from app.config import get_config
+from app.utils.cache_util import TtlLruCache
+from app.utils.result_util import Ok
+
+
+class VerifiedTokenCache:
+    """
+    Access tokens that already passed signature, exp and token_type checks, keyed by a digest
+    of the token and kept until the token's own exp. Holds the Ok result so a hit allocates nothing.
+
+    Only verification is cached, whether the user behind the token is still allowed in is
+    decided after decoding (AuthRequired), so revocation and status changes still apply.
+    Entries are dropped when the key ring changes so a removed key stops verifying right away.
+    """
+
+    def __init__(self, enabled: bool, max_entries: int):
+        self.enabled = enabled
+        self._results: TtlLruCache[bytes, Ok] = TtlLruCache(max_entries=max_entries)
+        self._key_version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str, key_version: int) -> Ok | None:
+        if not self.enabled:
+            return None
+
+        if key_version != self._key_version:
+            self._results.clear()
+            self._key_version = key_version
+
+        result = self._results.get(self._digest(token))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, token: str, result: Ok, key_version: int) -> None:
+        if not self.enabled or key_version != self._key_version:
+            return # verified against keys that are gone by now
+        self._results.set(self._digest(token), result, result.data["exp"])
+
+    def invalidate(self, token: str) -> None:
+        self._results.pop(self._digest(token))
+
+    def clear(self) -> None:
+        self._results.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache() # one cache per worker process
+def get_verified_token_cache() -> VerifiedTokenCache:
+    config = get_config()
+    return VerifiedTokenCache(
+        enabled=config.VERIFIED_TOKEN_CACHE_ENABLED,
+        max_entries=config.VERIFIED_TOKEN_CACHE_MAX_ENTRIES
+    )
@@ -0,0 +1,107 @@
+"""
+Shared setup for the benchmarks: a throwaway database with the schema migrated to head,
+and a per-task counter of the sql statements the app sends.
+
+Nothing from app is imported at module level, DATABASE_URL has to point at the throwaway
+database before app.utils.db_util creates the engine.
+"""
+import os
+import json
+import uuid
+import secrets
+import contextvars
+from pathlib import Path
+from contextlib import asynccontextmanager
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def benchmark_environment(rate_limit: bool = False) -> None:
+    # quiet, deterministic app settings, anything already set in the environment wins
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))
+    os.environ.setdefault("JWT_ACCESS_SECRET", secrets.token_hex(32))
+    os.environ.setdefault("JWT_REFRESH_SECRET", secrets.token_hex(32))
+    os.environ.setdefault("REAPER_ENABLED", "false")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "true" if rate_limit else "false")
+
+
+def _migrate(url: str) -> None:
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+
+    sync_url = make_url(url).set(drivername="postgresql+psycopg2").render_as_string(hide_password=False)
+    alembic_config = AlembicConfig(str(ROOT / "alembic.ini"))
+    alembic_config.set_main_option("script_location", str(ROOT / "alembic"))
+    alembic_config.set_main_option("sqlalchemy.url", sync_url.replace("%", "%%"))
+    command.upgrade(alembic_config, "head")
+
+
+@asynccontextmanager
+async def throwaway_database(admin_url: str, keep: bool = False):
+    """
+    Creates bench_<random> next to the database in admin_url (needs CREATEDB), migrates it,
+    points DATABASE_URL at it and drops it on the way out.
+    """
+    name = f"bench_{uuid.uuid4().hex[:12]}"
+    url = make_url(admin_url).set(database=name).render_as_string(hide_password=False)
+
+    admin_engine = create_async_engine(admin_url, isolation_level="AUTOCOMMIT")
+    try:
+        async with admin_engine.connect() as connection:
+            await connection.execute(text(f'CREATE DATABASE "{name}"'))
+
+        _migrate(url)
+        os.environ["DATABASE_URL"] = url
+        try:
+            yield url
+        finally:
+            if not keep:
+                from app.utils.db_util import dispose_engine # make sure nothing holds a connection
+                await dispose_engine()
+                async with admin_engine.connect() as connection:
+                    await connection.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    finally:
+        await admin_engine.dispose()
+
+
+# statements are counted into whatever list the current task set, so concurrent requests do not mix
+_statements: contextvars.ContextVar[list | None] = contextvars.ContextVar("benchmark_statements", default=None)
+
+
+def install_statement_counter() -> None:
+    from app.utils.db_util import get_engine
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements = _statements.get()
+        if statements is not None:
+            statements.append(statement)
+
+    event.listen(get_engine().sync_engine, "before_cursor_execute", count)
+
+
+def start_counting() -> list:
+    statements = []
+    _statements.set(statements)
+    return statements
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    # nearest rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def load_json(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path: str, data: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
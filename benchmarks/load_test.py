@@ -0,0 +1,276 @@
+"""
+End to end load test for the auth endpoints, runs app.main:app in process (httpx ASGI transport)
+against a throwaway postgres database created next to --admin-url.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --mix me=80,refresh=10,login=10 --concurrency 1,16,64 --duration 20
+    python -m benchmarks.load_test --output benchmarks/baseline.json      # save a baseline
+    python -m benchmarks.load_test --compare benchmarks/baseline.json     # exit 1 on regression
+
+Every virtual user is a signed up account with its own cookie jar, the mix picks what each one
+does next. Numbers include bcrypt (login, signup) so they depend on the machine, compare
+baselines from the same machine only.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import platform
+from dataclasses import dataclass
+from benchmarks.common import (
+    benchmark_environment,
+    throwaway_database,
+    install_statement_counter,
+    start_counting,
+    percentile,
+    load_json,
+    save_json,
+)
+
+OPERATIONS = ("signup", "login", "refresh", "logout", "me")
+DEFAULT_MIX = "me=70,refresh=10,login=10,signup=5,logout=5"
+PASSWORD = "benchmark-password"
+
+
+@dataclass
+class Sample:
+    operation: str
+    status: int
+    seconds: float
+    statements: int
+
+
+@dataclass
+class VirtualUser:
+    email: str
+    client: object # httpx.AsyncClient, keeps this user's refresh cookie
+    access: str | None = None
+
+    @property
+    def logged_in(self) -> bool:
+        return self.access is not None
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        operation, _, weight = part.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[operation] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one non zero weight")
+    return mix
+
+
+def signup_body(email: str) -> dict:
+    return dict(firstname="bench", lastname="user", email=email, password=PASSWORD, repeat=PASSWORD)
+
+
+def new_email() -> str:
+    return f"bench-{uuid.uuid4().hex}@example.com"
+
+
+async def signup_user(app, httpx) -> VirtualUser:
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    user = VirtualUser(email=new_email(), client=client)
+    response = await client.post("/api/auth/signup", json=signup_body(user.email))
+    response.raise_for_status()
+    user.access = response.json()["payload"]["access"]
+    return user
+
+
+async def perform(operation: str, user: VirtualUser, anonymous) -> int:
+    # returns the status code, keeps the user's session state in sync with what the server did
+    match operation:
+        case "signup":
+            # separate client so the new account's cookie does not replace this user's one
+            response = await anonymous.post("/api/auth/signup", json=signup_body(new_email()))
+        case "login":
+            response = await user.client.post("/api/auth/login", data=dict(email=user.email, password=PASSWORD))
+            if response.status_code == 200:
+                user.access = response.json()["payload"]["access"]
+        case "refresh":
+            response = await user.client.post("/api/auth/refresh")
+            if response.status_code == 200:
+                user.access = response.json()["payload"]["access"]
+        case "logout":
+            response = await user.client.post("/api/auth/logout")
+            user.access = None
+        case "me":
+            response = await user.client.get("/api/protected/me", headers={"Authorization": f"Bearer {user.access}"})
+    return response.status_code
+
+
+async def run_level(app, httpx, users: list[VirtualUser], mix: dict[str, float], concurrency: int, duration: float, max_requests: int | None, seed: int) -> tuple[list[Sample], float]:
+    operations = list(mix)
+    weights = list(mix.values())
+    samples: list[Sample] = []
+    deadline = time.perf_counter() + duration
+    anonymous = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    def done() -> bool:
+        return time.perf_counter() >= deadline or (max_requests is not None and len(samples) >= max_requests)
+
+    async def worker(index: int) -> None:
+        rng = random.Random(seed + index)
+        user = users[index]
+        while not done():
+            operation = rng.choices(operations, weights)[0]
+            if operation in ("refresh", "logout", "me") and not user.logged_in:
+                operation = "login" # logged out by an earlier logout, counts as a login
+
+            statements = start_counting()
+            started = time.perf_counter()
+            status = await perform(operation, user, anonymous)
+            samples.append(Sample(operation, status, time.perf_counter() - started, len(statements)))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    finally:
+        await anonymous.aclose()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: list[Sample], elapsed: float) -> dict:
+    def describe(group: list[Sample]) -> dict:
+        latencies = sorted(sample.seconds * 1000 for sample in group)
+        errors: dict[str, int] = {}
+        for sample in group:
+            if not 200 <= sample.status < 300:
+                errors[str(sample.status)] = errors.get(str(sample.status), 0) + 1
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "rps": round(len(group) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "statements_per_request": round(sum(sample.statements for sample in group) / len(group), 3) if group else 0.0,
+        }
+
+    summary = {"all": describe(samples)}
+    for operation in OPERATIONS:
+        group = [sample for sample in samples if sample.operation == operation]
+        if group:
+            summary[operation] = describe(group)
+    return summary
+
+
+def print_level(concurrency: int, summary: dict) -> None:
+    print(f"\nconcurrency {concurrency}")
+    print(f"  {'operation':<10}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'stmts/req':>11}  errors")
+    for operation, row in summary.items():
+        print(
+            f"  {operation:<10}{row['requests']:>10}{row['rps']:>10.1f}{row['p50_ms']:>10.1f}"
+            f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['statements_per_request']:>11.2f}  {row['errors'] or ''}"
+        )
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    # slower/fewer by more than tolerance is a regression, any extra statement per request is one too
+    regressions = []
+    for level, operations in current["levels"].items():
+        for operation, row in operations.items():
+            before = baseline.get("levels", {}).get(level, {}).get(operation)
+            if before is None:
+                continue
+
+            label = f"concurrency {level} {operation}"
+            if before["rps"] and row["rps"] < before["rps"] * (1 - tolerance):
+                regressions.append(f"{label}: rps {before['rps']} -> {row['rps']}")
+            if before["p95_ms"] and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+            if row["statements_per_request"] > before["statements_per_request"] + 0.01:
+                regressions.append(f"{label}: statements/request {before['statements_per_request']} -> {row['statements_per_request']}")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    benchmark_environment(rate_limit=args.rate_limit)
+    import httpx
+
+    async with throwaway_database(args.admin_url, keep=args.keep_database):
+        from app.main import app
+
+        install_statement_counter()
+        results = {
+            "meta": {
+                "mix": args.mix,
+                "duration": args.duration,
+                "requests": args.requests,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            "levels": {},
+        }
+
+        async with app.router.lifespan_context(app):
+            # a few at a time, the password hash pool rejects work past its queue limit
+            setup_slots = asyncio.Semaphore(8)
+
+            async def setup_user() -> VirtualUser:
+                async with setup_slots:
+                    return await signup_user(app, httpx)
+
+            users = await asyncio.gather(*(setup_user() for _ in range(max(args.concurrency))))
+            try:
+                if args.warmup:
+                    await run_level(app, httpx, users, args.mix, min(args.concurrency), args.warmup, None, args.seed)
+                    # the warmup may have logged some users out
+                    for user in users:
+                        if not user.logged_in:
+                            await perform("login", user, None)
+
+                for concurrency in args.concurrency:
+                    samples, elapsed = await run_level(app, httpx, users, args.mix, concurrency, args.duration, args.requests, args.seed)
+                    summary = summarize(samples, elapsed)
+                    results["levels"][str(concurrency)] = summary
+                    print_level(concurrency, summary)
+            finally:
+                for user in users:
+                    await user.client.aclose()
+
+    if args.output:
+        save_json(args.output, results)
+        print(f"\nsaved {args.output}")
+
+    if args.compare:
+        regressions = compare(load_json(args.compare), results, args.tolerance)
+        if regressions:
+            print(f"\nregressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nno regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the auth endpoints against a throwaway database")
+    parser.add_argument(
+        "--admin-url",
+        default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"),
+        help="async url of an existing database, the throwaway one is created next to it (default BENCH_DATABASE_URL or DATABASE_URL)"
+    )
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation=weight list (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 32], help="comma separated levels (default 1,8,32)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level (default 10)")
+    parser.add_argument("--requests", type=int, default=None, help="stop a level after this many requests")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of untimed traffic first (default 2)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rate-limit", action="store_true", help="keep login/signup throttling on")
+    parser.add_argument("--keep-database", action="store_true")
+    parser.add_argument("--output", help="write results as json, use as a baseline later")
+    parser.add_argument("--compare", help="baseline json to compare against, exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed rps/p95 drift before it counts as a regression (default 0.10)")
+    args = parser.parse_args()
+    if not args.admin_url:
+        parser.error("--admin-url (or BENCH_DATABASE_URL/DATABASE_URL) is required")
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,170 @@
+"""
+Microbenchmarks for the per-request primitives: jwt encode/decode (and the verified token cache),
+bcrypt at several cost factors, response rendering, StringUtil.generate_random and the Result wrappers.
+No database needed.
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter jwt --repeat 11
+    python -m benchmarks.micro --output benchmarks/micro_baseline.json
+    python -m benchmarks.micro --compare benchmarks/micro_baseline.json   # exit 1 on regression
+
+Each case is warmed up, timeit picks a loop count that takes ~0.2s, then --repeat samples of that
+many loops are taken (gc off, like timeit). The median per call is what gets compared.
+"""
+import os
+import sys
+import time
+import timeit
+import argparse
+import platform
+import statistics
+from typing import Callable
+from benchmarks.common import benchmark_environment, load_json, save_json
+
+
+def _cases(bcrypt_rounds: list[int]) -> dict[str, Callable[[], object]]:
+    from datetime import datetime, timezone, timedelta
+    from app.utils.jwt_util import JwtUtil, JwtType
+    from app.utils.jwk_util import KeyRing
+    from app.utils.token_cache_util import get_verified_token_cache
+    from app.utils.string_util import StringUtil
+    from app.utils.result_util import Ok, Error
+    from app.utils.bcrypt_util import get_pwd_context
+
+    jwt_util = JwtUtil()
+    string_util = StringUtil()
+    cases: dict[str, Callable[[], object]] = {}
+
+    # symmetric access tokens, the default setup
+    access_token = jwt_util.generate_access_token("a" * 32).unwrap_or_raise()
+    refresh_token = jwt_util.generate_refresh_token("a" * 32).unwrap_or_raise()
+    token_cache = get_verified_token_cache()
+    cases["jwt.generate_access_token.hs256"] = lambda: jwt_util.generate_access_token("a" * 32)
+    cases["jwt.generate_refresh_token.hs256"] = lambda: jwt_util.generate_refresh_token("a" * 32)
+    cases["jwt.decode_access_token.hs256.uncached"] = lambda: jwt_util._verify_access_token(access_token)
+    cases["jwt.decode_access_token.hs256.cached"] = lambda: jwt_util.decode_access_token(access_token)
+    cases["jwt.decode_refresh_token.hs256"] = lambda: jwt_util.decode_refresh_token(refresh_token)
+    cases["jwt.get_revocation_key"] = lambda: jwt_util.get_revocation_key(refresh_token, {"jti": "b" * 32})
+    jwt_util.decode_access_token(access_token) # fill the cache for the cached case
+    assert token_cache.enabled, "VERIFIED_TOKEN_CACHE_ENABLED is off, the cached case would measure a miss"
+
+    # asymmetric keys, generated in memory, sign/verify through the same code the app uses
+    now = datetime.now(timezone.utc)
+    for algorithm in ("RS256", "ES256", "EdDSA"):
+        keyring = KeyRing(algorithm=algorithm, rotation_days=30, publish_ahead_seconds=0, token_lifetime_seconds=1800, secret="benchmark")
+        keyring._load([keyring._new_key_model(now, has_active_key=False)])
+        key = keyring.get_signing_key()
+        exp = now + timedelta(minutes=30)
+        token = jwt_util._generate_token(key.private_key, "a" * 32, exp, JwtType.ACCESS, key.algorithm, {"kid": key.kid}).unwrap_or_raise()
+        name = algorithm.lower()
+        cases[f"jwt.encode.{name}"] = lambda key=key, exp=exp: jwt_util._generate_token(key.private_key, "a" * 32, exp, JwtType.ACCESS, key.algorithm, {"kid": key.kid})
+        cases[f"jwt.decode.{name}"] = lambda key=key, token=token: jwt_util._decode_token(key.public_key, token, JwtType.ACCESS, key.algorithm)
+
+    for rounds in bcrypt_rounds:
+        context = get_pwd_context().copy(default="bcrypt", bcrypt__rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+        hashed = context.hash("benchmark-password")
+        cases[f"bcrypt.hash.rounds{rounds}"] = lambda context=context: context.hash("benchmark-password")
+        cases[f"bcrypt.verify.rounds{rounds}"] = lambda context=context, hashed=hashed: context.verify("benchmark-password", hashed)
+
+    # a login/refresh response body, rendered by the compiled serializer
+    from app.schemas.auth import LoginResponseSchema, AccessToken
+    from app.utils.response_util import SchemaJSONResponse
+    cases["response.login.render"] = lambda: SchemaJSONResponse(
+        LoginResponseSchema.model_construct(payload=AccessToken.model_construct(access=access_token), code=200)
+    )
+
+    cases["string.generate_random.32"] = lambda: string_util.generate_random(32, 32)
+    cases["string.generate_random.8_16"] = lambda: string_util.generate_random(8, 16)
+
+    ok = Ok(1)
+
+    def error_raised_and_caught():
+        try:
+            Error(ValueError()).unwrap_or_raise()
+        except ValueError:
+            pass
+
+    cases["result.ok"] = lambda: Ok(1)
+    cases["result.error"] = lambda: Error(ValueError())
+    cases["result.ok.unwrap_or_raise"] = lambda: ok.unwrap_or_raise()
+    cases["result.ok.isinstance_error"] = lambda: isinstance(ok, Error)
+    cases["result.error.unwrap_or_raise"] = error_raised_and_caught
+    return cases
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup_seconds: float) -> dict:
+    # warm-up first (caches, lazy imports, cpu frequency), then size the loop so one sample takes ~0.2s
+    deadline = time.perf_counter() + warmup_seconds
+    while time.perf_counter() < deadline:
+        fn()
+
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    per_call = sorted(total / number for total in timer.repeat(repeat=repeat, number=number))
+    return {
+        "loops": number,
+        "repeat": repeat,
+        "min_us": round(per_call[0] * 1e6, 4),
+        "median_us": round(statistics.median(per_call) * 1e6, 4),
+        "mean_us": round(statistics.fmean(per_call) * 1e6, 4),
+        "stdev_us": round(statistics.stdev(per_call) * 1e6, 4) if repeat > 1 else 0.0,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, row in current["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if before is not None and row["median_us"] > before["median_us"] * (1 + tolerance):
+            regressions.append(f"{name}: {before['median_us']}us -> {row['median_us']}us")
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    benchmark_environment()
+    # Config requires one, nothing here connects to it
+    os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://benchmark@localhost/benchmark")
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "cases": {},
+    }
+
+    print(f"{'case':<44}{'loops':>9}{'median us':>13}{'min us':>13}{'stdev us':>12}")
+    for name, fn in _cases(args.bcrypt_rounds).items():
+        if args.filter and args.filter not in name:
+            continue
+        row = measure(fn, args.repeat, args.warmup)
+        results["cases"][name] = row
+        print(f"{name:<44}{row['loops']:>9}{row['median_us']:>13.3f}{row['min_us']:>13.3f}{row['stdev_us']:>12.3f}")
+
+    if args.output:
+        save_json(args.output, results)
+        print(f"\nsaved {args.output}")
+
+    if args.compare:
+        regressions = compare(load_json(args.compare), results, args.tolerance)
+        if regressions:
+            print(f"\nregressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nno regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for jwt, bcrypt, random strings and Result")
+    parser.add_argument("--filter", help="only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="samples per case (default 7)")
+    parser.add_argument("--warmup", type=float, default=0.2, help="seconds of warm-up per case (default 0.2)")
+    parser.add_argument("--bcrypt-rounds", type=lambda value: [int(rounds) for rounds in value.split(",")], default=[4, 10, 12], help="cost factors (default 4,10,12)")
+    parser.add_argument("--output", help="write results as json, use as a baseline later")
+    parser.add_argument("--compare", help="baseline json to compare against, exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed median drift before it counts as a regression (default 0.10)")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""
+Statement budgets per endpoint, fails when a change makes an endpoint send more sql than it should.
+
+    python -m benchmarks.query_budgets    # exit 1 if any endpoint goes over
+    python -m benchmarks.query_budgets --refresh-token-mode opaque
+
+query_budget() can also be used on its own around any request or model call:
+
+    async with query_budget(1, "login"):
+        await client.post("/api/auth/login", data=...)
+"""
+import os
+import sys
+import uuid
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+from benchmarks.common import benchmark_environment, throwaway_database, install_statement_counter, start_counting
+
+
+class QueryBudgetExceededError(AssertionError):
+    pass
+
+
+@asynccontextmanager
+async def query_budget(max_statements: int, label: str = "block"):
+    # install_statement_counter() must have been called once
+    statements = start_counting()
+    yield statements
+    if len(statements) > max_statements:
+        listing = "\n".join(f"  {index + 1}. {' '.join(statement.split())[:200]}" for index, statement in enumerate(statements))
+        raise QueryBudgetExceededError(f"{label}: {len(statements)} statements, budget is {max_statements}\n{listing}")
+
+
+# warm caches, which is what nearly every request sees
+# (the revocation cache answers /refresh, the principal cache answers a repeat /me)
+BUDGETS = {
+    "signup": 2, # email check, authid + user in one statement
+    "login": 1, # credentials join
+    "me (cold)": 1, # principal join
+    "me (cached)": 0,
+    "refresh": 2, # principal join + revoke insert
+    "logout": 1, # revoke insert
+    "logout-all": 2, # authid update + refresh session revoke, the principal comes from the cache
+    "me (cold x20)": 1, # parallel requests with one new token share the principal lookup
+}
+
+# REFRESH_TOKEN_MODE=opaque, anything not listed is the same as above
+OPAQUE_BUDGETS = {
+    "signup": 3, # + refresh session insert
+    "login": 2, # + refresh session insert
+    "refresh": 1, # use up the old token, issue the next one and load the principal in one statement
+}
+
+
+async def check(app, httpx, budgets: dict[str, int]) -> list[str]:
+    failures = []
+    email = f"budget-{uuid.uuid4().hex}@example.com"
+    password = "budget-password"
+
+    async def spend(label: str, request):
+        response = None
+        try:
+            async with query_budget(budgets[label], label) as statements:
+                response = await request()
+            print(f"  {label:<14}{len(statements):>3} / {budgets[label]}")
+        except QueryBudgetExceededError as e:
+            failures.append(str(e))
+            print(f"  {label:<14}{len(statements):>3} / {budgets[label]}  over budget")
+        response.raise_for_status()
+        return response
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await spend("signup", lambda: client.post("/api/auth/signup", json=dict(firstname="budget", lastname="user", email=email, password=password, repeat=password)))
+        response = await spend("login", lambda: client.post("/api/auth/login", data=dict(email=email, password=password)))
+        access = response.json()["payload"]["access"]
+        headers = {"Authorization": f"Bearer {access}"}
+        await spend("me (cold)", lambda: client.get("/api/protected/me", headers=headers))
+        await spend("me (cached)", lambda: client.get("/api/protected/me", headers=headers))
+        await spend("refresh", lambda: client.post("/api/auth/refresh"))
+        await spend("logout", lambda: client.post("/api/auth/logout"))
+        await spend("logout-all", lambda: client.post("/api/auth/logout-all", headers=headers))
+
+        async def burst(count: int, request):
+            # a page load, many requests at once with the same token
+            responses = await asyncio.gather(*(request() for _ in range(count)))
+            for response in responses:
+                response.raise_for_status()
+            return responses[0]
+
+        # logout-all gave the user a new authid, so nothing of it is cached yet
+        response = await client.post("/api/auth/login", data=dict(email=email, password=password))
+        headers = {"Authorization": f"Bearer {response.json()['payload']['access']}"}
+        await spend("me (cold x20)", lambda: burst(20, lambda: client.get("/api/protected/me", headers=headers)))
+    return failures
+
+
+async def main(args: argparse.Namespace) -> int:
+    benchmark_environment()
+    os.environ["REFRESH_TOKEN_MODE"] = args.refresh_token_mode
+    budgets = {**BUDGETS, **OPAQUE_BUDGETS} if args.refresh_token_mode == "opaque" else BUDGETS
+    import httpx
+
+    async with throwaway_database(args.admin_url):
+        from app.main import app
+
+        install_statement_counter()
+        async with app.router.lifespan_context(app):
+            print(f"statements / budget ({args.refresh_token_mode} refresh tokens)")
+            failures = await check(app, httpx, budgets)
+
+    for failure in failures:
+        print(f"\n{failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check sql statement budgets per endpoint")
+    parser.add_argument(
+        "--admin-url",
+        default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"),
+        help="async url of an existing database, the throwaway one is created next to it (default BENCH_DATABASE_URL or DATABASE_URL)"
+    )
+    parser.add_argument("--refresh-token-mode", choices=["jwt", "opaque"], default="jwt")
+    args = parser.parse_args()
+    if not args.admin_url:
+        parser.error("--admin-url (or BENCH_DATABASE_URL/DATABASE_URL) is required")
+    sys.exit(asyncio.run(main(args)))
@@ -35,5 +35,11 @@ echo "PostgreSQL is up, running migrations..."
 
 alembic upgrade head
 
+# the workers share metrics through files in this dir, stale ones from a previous run must go
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "Starting FastAPI..."
-exec uvicorn app.main:app --host 0.0.0.0 --port 5000 --workers 4
+# workers are forked from one process that already imported the app, see app/cli/serve.py
+exec python -m app.cli.serve --host 0.0.0.0 --port 5000 --workers 4
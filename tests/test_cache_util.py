@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from app.utils.cache_util import SingleFlight
+
+
+def test_single_flight_shares_value():
+    async def main():
+        flight: SingleFlight[str, int] = SingleFlight()
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            return 42
+
+        results = await asyncio.gather(*(flight.do("a", load) for _ in range(5)))
+        return results, loads, flight
+
+    results, loads, flight = asyncio.run(main())
+    assert results == [42] * 5
+    assert loads == 1
+    assert flight.coalesced == 4
+    assert len(flight) == 0
+
+
+def test_single_flight_shares_error():
+    async def main():
+        flight: SingleFlight[str, int] = SingleFlight()
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("lookup failed")
+
+        results = await asyncio.gather(*(flight.do("a", load) for _ in range(5)), return_exceptions=True)
+        return results, loads, flight
+
+    results, loads, flight = asyncio.run(main())
+    # every waiter gets the leader's error, none of them runs load again
+    assert loads == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "lookup failed" for r in results)
+    assert len(flight) == 0
+
+
+def test_single_flight_waiters_retry_after_leader_cancelled():
+    async def main():
+        flight: SingleFlight[str, int] = SingleFlight()
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            return loads
+
+        leader = asyncio.create_task(flight.do("a", load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("a", load))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter, loads
+
+    value, loads = asyncio.run(main())
+    assert (value, loads) == (2, 2)
+
+
+def test_single_flight_error_without_waiters_is_raised():
+    async def main():
+        flight: SingleFlight[str, int] = SingleFlight()
+
+        async def load():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await flight.do("a", load)
+        # the next call runs its own load
+        async def ok():
+            return 1
+        return await flight.do("a", ok)
+
+    assert asyncio.run(main()) == 1